@@ -0,0 +1,191 @@
+#!/usr/bin/python
+"""Benchmark the file operations of the installer.
+
+Build a synthetic tree in a temporary directory, then time linking and copying
+it with the jobs of `installer.file`, and installing fonts from a synthetic
+archive with `installer.font`. Every scenario is run several times:
+
+- "cold" installs into a fresh destination each time;
+- "warm" re-runs an install into the same destination;
+- "dry" does a dry run into a fresh destination.
+
+Nothing touches the network or anything outside the temporary directory, so
+results of different revisions on the same machine are comparable.
+
+Usage: python bench/bench_file.py [--files N] [--depth N] [--size BYTES]
+                                  [--repeat N] [--copy-strategy S] [--json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+from typing import Callable, List
+
+# Import the installer from this checkout.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from installer.file import copy, link  # noqa: E402
+from installer.font import install_fonts_in_zip  # noqa: E402
+from installer.job import Job, set_current_job  # noqa: E402
+from installer.opt import Options  # noqa: E402
+from tree import make_tree  # noqa: E402
+
+
+def percentile(samples: List[float], p: float) -> float:
+    """Return the `p`th percentile of `samples`, interpolated."""
+    samples = sorted(samples)
+    k = (len(samples) - 1) * p / 100
+    lo = int(k)
+    hi = min(lo + 1, len(samples) - 1)
+    return samples[lo] + (samples[hi] - samples[lo]) * (k - lo)
+
+
+def measure(
+    name: str, files: int, repeat: int, make_job: Callable[[int], Job]
+) -> dict:
+    """Time `repeat` runs of scenario `name`, returning its result.
+
+    `make_job` is called with the index of the run to prepare it, untimed, and
+    returns the job whose action to time. Throughput is of the bytes the job
+    has copied, so runs finding everything up to date move no data.
+    """
+    samples = []
+    copied = []
+    for i in range(repeat):
+        job = make_job(i)
+        set_current_job(job)
+        try:
+            start = time.perf_counter()
+            job.action()
+            samples.append(time.perf_counter() - start)
+        finally:
+            set_current_job(None)
+        copied.append(job.counters.get("bytes_copied", 0))
+    median = statistics.median(samples)
+    size = int(statistics.median(copied))
+    return {
+        "scenario": name,
+        "files": files,
+        "bytes": size,
+        "runs": repeat,
+        "p50": median,
+        "p90": percentile(samples, 90),
+        "max": max(samples),
+        "files_per_s": files / median if median else None,
+        "mb_per_s": size / median / 1e6 if median and size else None,
+    }
+
+
+def make_font_zip(path: Path, fonts: int, size: int) -> None:
+    """Make an archive of `fonts` fake fonts of `size` bytes at `path`."""
+    data = os.urandom(size)
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as zf:
+        for i in range(fonts):
+            zf.writestr(f"ZyFonts/family{i % 10}/font{i}.ttf", data)
+
+
+def job_scenarios(
+    tmp: Path, src: Path, files: int, repeat: int, jobs: int, strategy: str
+):
+    """Yield results of the link and copy scenarios, copying by `strategy`."""
+    opt = Options(jobs=jobs, copy_strategy=strategy)
+    dry_opt = Options(dry=True, jobs=jobs, copy_strategy=strategy)
+    for name, make_job in [("link", link), ("copy", copy)]:
+        dst = tmp.joinpath(f"{name}-warm")
+        make_job(str(src), str(dst), opt).action()
+
+        def cold(i, name=name, make_job=make_job):
+            return make_job(str(src), str(tmp.joinpath(f"{name}-cold-{i}")), opt)
+
+        def warm(i, dst=dst, make_job=make_job):
+            return make_job(str(src), str(dst), opt)
+
+        def dry(i, name=name, make_job=make_job):
+            return make_job(str(src), str(tmp.joinpath(f"{name}-dry-{i}")), dry_opt)
+
+        yield measure(f"{name} cold", files, repeat, cold)
+        yield measure(f"{name} warm", files, repeat, warm)
+        yield measure(f"{name} dry", files, repeat, dry)
+
+
+def font_scenarios(tmp: Path, fonts: int, size: int, repeat: int, jobs: int):
+    """Yield results of the font scenarios."""
+    zip = tmp.joinpath("ZyFonts.zip")
+    make_font_zip(zip, fonts, size)
+    warm_dir = tmp.joinpath("fonts-warm")
+    warm_dir.mkdir()
+    install_fonts_in_zip(zip, warm_dir, Options(jobs=jobs))
+
+    def install(fontdir: Path) -> Job:
+        return Job(
+            "Installing fonts",
+            lambda: install_fonts_in_zip(zip, fontdir, Options(jobs=jobs)),
+        )
+
+    def cold(i):
+        fontdir = tmp.joinpath(f"fonts-cold-{i}")
+        fontdir.mkdir()
+        return install(fontdir)
+
+    def warm(i):
+        return install(warm_dir)
+
+    yield measure("fonts cold", fonts, repeat, cold)
+    yield measure("fonts warm", fonts, repeat, warm)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark installer file operations.")
+    parser.add_argument("--files", type=int, default=2000, help="files in the tree")
+    parser.add_argument("--depth", type=int, default=3, help="depth of the tree")
+    parser.add_argument("--size", type=int, default=4096, help="bytes per file")
+    parser.add_argument("--fonts", type=int, default=20, help="fonts in the archive")
+    parser.add_argument("--font-size", type=int, default=1 << 20, help="bytes per font")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per scenario")
+    parser.add_argument("--jobs", type=int, default=1, help="workers for fonts")
+    parser.add_argument(
+        "--copy-strategy",
+        choices=["auto", "reflink", "hardlink", "copy"],
+        default="auto",
+        help="how to copy files",
+    )
+    parser.add_argument("--json", action="store_true", help="print JSON Lines")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmp = Path(tmpdir)
+        # Keep the cache of the installer inside the temporary directory.
+        os.environ["XDG_CACHE_HOME"] = str(tmp.joinpath("cache"))
+        src = tmp.joinpath("src")
+        make_tree(src, args.files, depth=args.depth, size=args.size)
+
+        results = list(
+            job_scenarios(
+                tmp, src, args.files, args.repeat, args.jobs, args.copy_strategy
+            )
+        )
+        results += font_scenarios(
+            tmp, args.fonts, args.font_size, args.repeat, args.jobs
+        )
+
+    if args.json:
+        for result in results:
+            print(json.dumps(result))
+        return
+    print(f"{'scenario':<12} {'p50 (s)':>9} {'p90 (s)':>9} {'max (s)':>9} "
+          f"{'files/s':>10} {'MB/s':>9}")
+    for r in results:
+        files_per_s = f"{r['files_per_s']:10.0f}" if r["files_per_s"] else f"{'-':>10}"
+        mb_per_s = f"{r['mb_per_s']:9.1f}" if r["mb_per_s"] else f"{'-':>9}"
+        print(f"{r['scenario']:<12} {r['p50']:9.4f} {r['p90']:9.4f} {r['max']:9.4f} "
+              f"{files_per_s} {mb_per_s}")
+
+
+if __name__ == "__main__":
+    main()
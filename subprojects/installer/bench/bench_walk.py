@@ -0,0 +1,88 @@
+#!/usr/bin/python
+"""Count the system calls of walking and linking a synthetic tree.
+
+Compare the old `Path.iterdir` recursion with the `os.scandir` walker in
+`installer.walk`, then count the calls of a cold and a warm
+`link_recursively`. Calls are counted by wrapping the functions of `os` that
+`pathlib` and the installer go through; what `os.DirEntry` does internally is
+not visible, which is the point of using it.
+
+Usage: python bench/bench_walk.py [FILES]
+"""
+
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+# Import the installer from this checkout.
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from installer.file import link_recursively  # noqa: E402
+from installer.walk import walk  # noqa: E402
+from tree import make_tree  # noqa: E402
+
+# Functions of `os` whose calls are counted.
+COUNTED = ["stat", "lstat", "listdir", "scandir", "readlink", "symlink", "mkdir"]
+
+
+def old_walk(path: Path) -> int:
+    """Walk `path` like the installer used to, returning the number of files."""
+    if path.is_file():
+        return 1
+    return sum(old_walk(entry) for entry in path.iterdir())
+
+
+def new_walk(path: Path) -> int:
+    """Walk `path` with `installer.walk`, returning the number of files."""
+    return sum(not entry.is_dir() for _, entry in walk(path))
+
+
+def count_calls(func, *args) -> Counter:
+    """Call `func` with `args`, counting calls to the functions of `os`."""
+    counts: Counter = Counter()
+    originals = {name: getattr(os, name) for name in COUNTED}
+
+    def wrap(name):
+        def wrapper(*args, **kwargs):
+            counts[name] += 1
+            return originals[name](*args, **kwargs)
+
+        return wrapper
+
+    for name in COUNTED:
+        setattr(os, name, wrap(name))
+    start = time.perf_counter()
+    try:
+        func(*args)
+    finally:
+        for name, original in originals.items():
+            setattr(os, name, original)
+    counts["seconds"] = time.perf_counter() - start
+    return counts
+
+
+def report(label: str, counts: Counter) -> None:
+    seconds = counts.pop("seconds")
+    calls = ", ".join(f"{name}={counts[name]}" for name in COUNTED if counts[name])
+    print(f"{label:<24} {sum(counts.values()):>7} calls  {seconds:7.3f}s  {calls}")
+
+
+def main() -> None:
+    files = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    with tempfile.TemporaryDirectory() as tmp:
+        # Keep the state file of the installer inside the temporary directory.
+        os.environ["XDG_CACHE_HOME"] = str(Path(tmp, "cache"))
+        src, dst = Path(tmp, "src"), Path(tmp, "dst")
+        make_tree(src, files)
+        print(f"Tree of {files} files in {src}")
+        report("Path.iterdir walk", count_calls(old_walk, src))
+        report("os.scandir walk", count_calls(new_walk, src))
+        report("link_recursively cold", count_calls(link_recursively, src, dst))
+        report("link_recursively warm", count_calls(link_recursively, src, dst))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,23 @@
+"""Synthetic trees for the benchmarks."""
+
+import os
+from pathlib import Path
+
+
+def make_tree(root: Path, files: int, depth: int = 3, fanout: int = 10, size: int = 0) -> int:
+    """Make a tree of `files` files of `size` bytes under `root`.
+
+    Files are spread over directories nested `depth` levels deep, each with
+    `fanout` subdirectories. Return the total size of the files.
+    """
+    data = os.urandom(size)
+    for i in range(files):
+        parts = []
+        n = i // fanout
+        for _ in range(depth):
+            parts.append(f"d{n % fanout}")
+            n //= fanout
+        dir = root.joinpath(*parts)
+        dir.mkdir(parents=True, exist_ok=True)
+        dir.joinpath(f"f{i}").write_bytes(data)
+    return files * size
@@ -1,28 +1,42 @@
 """Cross-platform installation script for my dotfiles."""
 
 import argparse
+import logging
+import shutil
 import sys
 import time
+from typing import List
 
-from installer.ahk import ahk_install_all
-from installer.cmd import run
-from installer.file import link
-from installer.font import install_zyfonts
-from installer.man import man_cmd
+# Modules only needed on some systems or with some options are imported where
+# they are used, to keep startup fast.
+from installer.console import get_console, setup_console
+from installer.diff import get_diff
+from installer.file import copy_summary
+from installer.journal import get_journal
 from installer.opt import Options
-from installer.os import IS_LINUX, IS_WINDOWS, IS_WSL
+from installer.os import IS_WINDOWS, IS_WSL
 from installer.path import setup_directory, to_path
-from installer.rime import win_rime_setup
-from installer.style import emph, setup_logging
+from installer.plan import Entry, load_plan, schedule_plan
+from installer.sched import Scheduler
+from installer.state import save_state
+from installer.style import emph
 
 
 def main():
     # Get options through arguments.
     parser = argparse.ArgumentParser(description="Install Zyxir's dotfiles.")
+    parser.add_argument(
+        "command",
+        nargs="?",
+        choices=["install", "verify"],
+        default="install",
+        help="install the dotfiles (default), or verify the installation without "
+        "changing anything, exiting with 1 on drift and 2 on errors",
+    )
     parser.add_argument(
         "--dry",
         action="store_true",
-        help="perform a dry run (only print; don't install anything)",
+        help="perform a dry run (only show what would change; don't install anything)",
     )
     parser.add_argument(
         "--fonts",
@@ -32,69 +46,188 @@ def main():
     parser.add_argument(
         "--switch",
         action="store_true",
-        help="do a home-manager switch",
+        help="do a home-manager switch, unless its configuration is unchanged "
+        "since the last one",
+    )
+    parser.add_argument(
+        "--force-switch",
+        action="store_true",
+        help="do a home-manager switch even if its configuration is unchanged",
     )
     parser.add_argument(
         "--complete",
         action="store_true",
         help="perform a complete run: do every optional actions",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        metavar="N",
+        help="run up to N independent jobs at once (default: 1)",
+    )
+    parser.add_argument(
+        "--dir-links",
+        action="store_true",
+        help="link whole directories instead of every file in them where possible",
+    )
+    parser.add_argument(
+        "--copy-strategy",
+        choices=["auto", "reflink", "hardlink", "copy"],
+        default="auto",
+        help="how to copy files: share data via a reflink, make a hard link, or "
+        "copy the data (default: the cheapest possible)",
+    )
+    parser.add_argument(
+        "--rollback",
+        action="store_true",
+        help="roll back an interrupted run instead of resuming it, then exit",
+    )
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="keep running, and link or copy files again as they change",
+    )
+    parser.add_argument(
+        "--report",
+        metavar="PATH",
+        help="write a JSON Lines report of every job to PATH",
+    )
+    parser.add_argument(
+        "--profile",
+        metavar="DIR",
+        help="profile jobs one at a time with cProfile, writing statistics of each "
+        "to DIR and showing the slowest functions at the end",
+    )
+    parser.add_argument(
+        "--profile-job",
+        metavar="PATTERN",
+        help="only profile jobs whose message matches shell-style PATTERN",
+    )
+    parser.add_argument(
+        "--profile-memory",
+        action="store_true",
+        help="trace memory allocations of profiled jobs with tracemalloc too",
+    )
+    parser.add_argument(
+        "--root",
+        action="append",
+        metavar="DIR",
+        help="install into home directory DIR instead of the current one, in a "
+        "process of its own; repeatable, and @FILE reads directories from FILE",
+    )
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        action="store_true",
+        help="only show failures and warnings",
+    )
     parser.add_argument("--debug", action="store_true", help="show debug messages")
     args = parser.parse_args()
+    if args.root and (args.command != "install" or args.watch or args.rollback):
+        parser.error("--root only works with a plain installation")
+    if args.root and (args.switch or args.force_switch or args.complete):
+        # Every root would switch the profile of the invoking user at once.
+        parser.error(
+            "--root cannot be used with --switch, --force-switch or --complete"
+        )
+    if (args.profile_job or args.profile_memory) and not args.profile:
+        parser.error("--profile-job and --profile-memory require --profile")
+    if args.profile and (args.command != "install" or args.root):
+        parser.error("--profile only works with an installation without --root")
     opt = Options(
         dry=args.dry,
-        switch=args.switch or args.complete,
+        switch=args.switch or args.complete or args.force_switch,
+        rerun=args.force_switch,
         fonts=args.fonts or args.complete,
+        jobs=args.jobs,
+        dir_links=args.dir_links,
+        copy_strategy=args.copy_strategy,
     )
 
-    # Set up logging.
-    setup_logging(args.debug)
+    # Set up the console and logging.
+    setup_console("quiet" if args.quiet else None, args.debug)
+    console = get_console()
+
+    # Resolve paths in arguments before leaving the current directory.
+    report = to_path(args.report) if args.report else None
+    profiler = None
+    if args.profile:
+        from installer.prof import setup_profiler
+
+        profiler = setup_profiler(
+            to_path(args.profile), args.profile_job, args.profile_memory
+        )
+    roots = []
+    if args.root:
+        from installer.fanout import read_roots
+
+        roots = read_roots(args.root)
 
     # Make sure the script is run in the correct directory.
     try:
         setup_directory()
     except Exception:
-        print("Cannot locate the dotfiles repo.")
+        logging.error("Cannot locate the dotfiles repo.")
         sys.exit(1)
 
+    # Verify instead of installing if asked to.
+    if args.command == "verify":
+        from installer.verify import verify
+
+        sys.exit(verify(load_plan("./install.json", cache=False), opt))
+
+    # Install into other home directories if asked to.
+    if roots:
+        from installer.fanout import install_roots
+
+        sys.exit(1 if install_roots(roots, opt, args.debug) else 0)
+
+    # Roll back or resume an interrupted run.
+    journal = get_journal()
+    if args.rollback:
+        undone = journal.rollback()
+        journal.commit()
+        console.message(f"Rolled back {undone} changes of the interrupted run.")
+        return
+    elif journal.interrupted() and not opt.dry:
+        console.message("Resuming an interrupted run.")
+        journal.commit()
+
     # Notify a dry run.
     if opt.dry:
-        print("This is a {}. Nothing is actually installed.".format(emph("dry run")))
+        console.message(
+            "This is a {}. Nothing is actually installed.".format(emph("dry run"))
+        )
 
     # Start timing.
     start_time = time.time()
 
-    # Install dot files.
-    if IS_LINUX:
-        link("./shell/bash/bashrc", "~/.bashrc", opt)
-        link("./shell/bash/bash_profile", "~/.bash_profile", opt)
-        link("./shell/zsh/zshrc", "~/.zshrc", opt)
-        link("./shell/zsh/zshenv", "~/.zshenv", opt)
-        link("./apps/fontconfig/fonts.conf", "~/.config/fontconfig/fonts.conf", opt)
-        link(
-            "./apps/nix/home-manager/home.nix",
-            "~/.config/home-manager/home.nix",
-            opt,
-        )
-        if opt.switch:
-            run("home-manager switch", opt)
-    elif IS_WINDOWS:
-        link("./apps/git/dot_gitconfig", "~/.gitconfig", opt)
-        link(
-            "./shell/PowerShell/Microsoft.PowerShell_profile.ps1",
-            "~/Documents/WindowsPowerShell/Microsoft.PowerShell_profile.ps1",
-            opt,
-        )
-        link("./apps/rime", "%appdata%/rime", opt)
-        win_rime_setup(opt)
-        ahk_install_all("./AutoHotkey", opt)
+    # Collect jobs.
+    sched = Scheduler(opt.jobs)
+    try:
+        plan = schedule_install(sched, opt)
+    except Exception as e:
+        logging.error(e)
+        sys.exit(1)
 
-    # Install fonts.
-    if opt.fonts:
-        install_zyfonts(opt)
+    # Run all jobs.
+    sched.run()
+    save_state()
+    if not opt.dry:
+        journal.commit()
+    else:
+        get_diff().report()
+    if opt.fonts and IS_WINDOWS:
+        from installer.font import print_zyfonts_hint
+
+        print_zyfonts_hint()
 
     # Suggest manual commands.
     if IS_WSL:
+        from installer.man import man_cmd
+
         man_cmd(
             "/usr/share/applications/emacs.desktop",
             "Run the following command to enable starting Emacs from Windows:",
@@ -104,5 +237,50 @@ def main():
         )
 
     # Say goodbye.
-    elapsed_time = time.time() - start_time
-    print(f"Finished in {elapsed_time:.3f} seconds.")
+    end_time = time.time()
+    elapsed_time = end_time - start_time
+    console.message(f"Finished in {elapsed_time:.3f} seconds.")
+    summary = copy_summary(sched.queue)
+    if summary is not None:
+        console.message(summary)
+    if report is not None:
+        from installer.report import write_report
+
+        write_report(str(report), sched.queue, start_time, end_time)
+    if profiler is not None:
+        profiler.report()
+
+    # Keep applying changes if asked to.
+    if args.watch:
+        from installer.watch import watch
+
+        try:
+            watch(plan, opt)
+        except KeyboardInterrupt:
+            console.message("Stopped watching.")
+
+
+def schedule_install(sched: Scheduler, opt: Options) -> List[Entry]:
+    """Add every job of an installation to `sched`, returning the plan."""
+    # Collect jobs to install dot files.
+    plan = load_plan("./install.json")
+    jobs = schedule_plan(sched, plan, opt)
+    if IS_WINDOWS:
+        from installer.ahk import ahk_install_all
+        from installer.rime import rime_deploy, win_rime_setup
+
+        rime_setup = sched.add(win_rime_setup(opt), after=[jobs["rime"]])
+        sched.add(rime_deploy("%appdata%/rime", opt), after=[rime_setup])
+        sched.add_all(ahk_install_all("./AutoHotkey", opt))
+    elif shutil.which("rime_deployer"):
+        from installer.rime import rime_deploy
+
+        # Nothing links Rime data on Linux, so build it where it is.
+        sched.add(rime_deploy("./apps/rime", opt))
+
+    # Collect jobs to install fonts.
+    if opt.fonts:
+        from installer.font import install_zyfonts
+
+        sched.add_all(install_zyfonts(opt))
+    return plan
@@ -1,4 +1,7 @@
 from installer import main
 
 
-main()
+# Guard the entry, since processes started by `multiprocessing` via "spawn"
+# import this module again.
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,96 @@
-"""Utility for handling AutoHotkey scripts."""
+"""Utility for handling AutoHotkey scripts.
+
+Compiling scripts is skipped if the compiled program is up to date: the cache
+records the hash of each script compiled, along with the program it resulted
+in. Each script is installed by its own job, so that they are compiled
+concurrently by the scheduler.
+"""
 
 
 import logging
+import os
+from functools import lru_cache
 from pathlib import Path
+from typing import List, Optional
 
-from installer.cmd import run_cmd
-from installer.file import copy_path
+from installer.cache import Store
+from installer.cmd import Runner, run_cmd
+from installer.diff import record_change
+from installer.file import copy_path, file_digest
 from installer.job import Job
 from installer.opt import Options
 from installer.path import to_path
+from installer.state import stat_key
 from installer.style import emph_path
 
 
-def ahk_install_all(dir: str, opt: Options) -> None:
-    """Install all AutHotkey scripts in `dir`, handling errors."""
+def ahk_install_all(
+    dir: str, opt: Options, runner: Runner = run_cmd, ahk2exe: Optional[Path] = None
+) -> List[Job]:
+    """Return jobs installing all AutHotkey scripts in `dir`, handling errors.
+
+    Scripts are compiled with `ahk2exe` (defaults to the one found by
+    `ensure_ahk2exe`), which is run by `runner`.
+    """
     dir_path = to_path(dir)
     if dir_path.exists():
-        for file in dir_path.glob("*.ahk"):
-            ahk_install(file, opt)
+        store = Store("ahk.json")
+        return [
+            ahk_install(file, opt, runner, ahk2exe, store)
+            for file in dir_path.glob("*.ahk")
+        ]
     else:
-        logging.warn(f"{emph_path(dir)} not found, no AutoHotkey script is installed.")
-
-
-def ahk_install(file: Path, opt: Options) -> None:
-    """Install AutoHotkey script `file`, handling errors."""
+        logging.warning(
+            "%s not found, no AutoHotkey script is installed.", emph_path(dir)
+        )
+        return []
+
+
+def ahk_install(
+    file: Path,
+    opt: Options,
+    runner: Runner = run_cmd,
+    ahk2exe: Optional[Path] = None,
+    store: Optional[Store] = None,
+) -> Job:
+    """Return a job installing AutoHotkey script `file`, handling errors.
+
+    See `ahk_install_all` for `runner` and `ahk2exe`. If `store` is not `None`,
+    skip compiling if it records `file` as compiled.
+    """
     msg = f"Installing AutoHotkey script {emph_path(file)}."
 
-    def action() -> None:
-        ahk2exe = ensure_ahk2exe()
-        exe = ahk_compile_file(file, ahk2exe, opt)
+    def action() -> Optional[str]:
+        exe = file.parent.joinpath(file.stem + ".exe")
+        digest = file_digest(file).hex()
+        note = None
+        if store is not None and is_compiled(store, file, exe, digest):
+            note = "compiling skipped"
+        else:
+            ahk_compile_file(file, ahk2exe or ensure_ahk2exe(), opt, runner)
+            if store is not None and not opt.dry:
+                store.set(str(file), {"digest": digest, "exe": stat_key(os.stat(exe))})
         ahk_install_exe(exe, opt)
+        return note
+
+    return Job(msg, action)
+
 
-    Job(msg, action).run()
+def is_compiled(store: Store, file: Path, exe: Path, digest: str) -> bool:
+    """Return `True` if `store` records `exe` as compiled from `file`.
+
+    `digest` is the digest of the current content of `file`.
+    """
+    record = store.get(str(file))
+    if record is None or record["digest"] != digest:
+        return False
+    try:
+        return stat_key(os.stat(exe)) == record["exe"]
+    except OSError:
+        return False
 
 
+@lru_cache(maxsize=None)
 def ensure_ahk2exe() -> Path:
     """Ensure and return the \"Ahk2Exe.exe\" program."""
     path = Path.home().joinpath("AppData\\Local\\Programs\\AutoHotkey\\Compiler\\Ahk2Exe.exe")
@@ -42,13 +99,15 @@ def ensure_ahk2exe() -> Path:
     return path
 
 
-def ahk_compile_file(file: Path, ahk2exe: Path, opt: Options) -> Path:
-    """Compile \".ahk\" `file` into a \".exe\" program.
+def ahk_compile_file(
+    file: Path, ahk2exe: Path, opt: Options, runner: Runner = run_cmd
+) -> Path:
+    """Compile \".ahk\" `file` into a \".exe\" program, via `runner`.
 
     Return the path of the \".exe\" program.
     """
     cmd = f"{ahk2exe} /in {file}"
-    if run_cmd(cmd, opt, cwd=file.parent) == 0:
+    if runner(cmd, opt, cwd=file.parent) == 0:
         return file.parent.joinpath(file.stem + ".exe")
     else:
         raise Exception(f"Error compiling {emph_path(file)}")
@@ -58,4 +117,8 @@ def ahk_install_exe(file: Path, opt: Options):
     """Install AutoHotkey program \"file\" into the proper path."""
     startup_path = to_path("%appdata%/Microsoft/Windows/Start Menu/Programs/Startup")
     dst_path = startup_path.joinpath(file.name)
+    if opt.dry and not file.exists():
+        # The program is not compiled in a dry run.
+        record_change("create", "copy", str(dst_path))
+        return
     copy_path(file, dst_path, opt)
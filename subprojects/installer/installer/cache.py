@@ -0,0 +1,75 @@
+"""Utility for the installer's cache directory.
+
+Everything the installer remembers between runs lives here, so removing the
+directory only makes the next run slower.
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+from threading import Lock
+from typing import Any, Dict
+
+from installer.os import IS_WINDOWS
+from installer.style import emph_path
+
+
+def cache_dir(*parts: str) -> Path:
+    """Return the directory `parts` in the installer's cache, creating it."""
+    if IS_WINDOWS:
+        base = os.environ.get("LOCALAPPDATA") or Path.home().joinpath("AppData/Local")
+    else:
+        base = os.environ.get("XDG_CACHE_HOME") or Path.home().joinpath(".cache")
+    path = Path(base).joinpath("zyxir-dotfiles", *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+class Store:
+    """A JSON object kept in file `name` of the cache.
+
+    Changes are saved immediately by default, so a store is safe to use across
+    jobs and interrupted runs. Many small changes may instead be saved at once
+    by `save`.
+    """
+
+    def __init__(self, name: str) -> None:
+        self.path = cache_dir().joinpath(name)
+        self.lock = Lock()
+        self.dirty = False
+        self.data: Dict[str, Any] = {}
+        try:
+            with open(self.path, "r") as f:
+                self.data = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.debug("Ignoring broken cache %s: %s", emph_path(self.path), e)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return the value of `key`, or `default` if there is none."""
+        with self.lock:
+            return self.data.get(key, default)
+
+    def set(self, key: str, value: Any, save: bool = True) -> None:
+        """Set the value of `key` to `value`, and save the store if `save`."""
+        with self.lock:
+            self.data[key] = value
+            self.dirty = True
+            if save:
+                self._save()
+
+    def save(self) -> None:
+        """Save the store if anything has changed."""
+        with self.lock:
+            self._save()
+
+    def _save(self) -> None:
+        if not self.dirty:
+            return
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
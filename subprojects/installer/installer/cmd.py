@@ -1,28 +1,87 @@
 """Utility for running external commands."""
 
 
+import hashlib
 import logging
+import os
 from os import PathLike
+from pathlib import Path
 import shutil
 import subprocess
-from typing import Optional
-from installer.job import Job
+from threading import Thread
+from typing import IO, Callable, List, Optional
 
+from installer.cache import Store
+from installer.diff import record_change
+from installer.file import file_digest
+from installer.job import Job, count
 from installer.opt import Options
 from installer.style import emph_cmd, emph_path
+from installer.walk import walk
 
+# A function running a command like `run_cmd`.
+Runner = Callable[..., int]
 
-def run(cmd: str, opt: Options, cwd: Optional[PathLike] = None, shell: bool = False) -> None:
-    """Run external command `cmd`, handling errors."""
+
+def run(
+    cmd: str,
+    opt: Options,
+    cwd: Optional[PathLike] = None,
+    shell: bool = False,
+    timeout: Optional[float] = None,
+    inputs: Optional[List[str]] = None,
+) -> Job:
+    """Return a job running external command `cmd`, handling errors.
+
+    The job fails if the command exits with a non-zero code or runs out of
+    `timeout`. If paths `inputs` are given, the command is skipped if they are
+    unchanged since it last succeeded, unless `opt.rerun`.
+    """
     msg = f"Running {emph_cmd(cmd)}"
     if cwd is not None:
         msg += f" in {emph_path(cwd)}"
 
-    def action() -> None:
+    def action() -> Optional[str]:
+        digest = None
+        if inputs is not None:
+            store = Store("runs.json")
+            digest = inputs_digest(cmd, inputs)
+            if not opt.rerun and store.get(cmd) == digest:
+                return "inputs unchanged, skipped"
         ensure_exe(cmd)
-        run_cmd(cmd, opt, cwd, shell)
+        code = run_cmd(cmd, opt, cwd, shell, timeout)
+        if code != 0:
+            raise Exception(f"{emph_cmd(cmd)} exited with code {code}")
+        if digest is not None and not opt.dry:
+            store.set(cmd, digest)
+        return None
+
+    return Job(msg, action)
+
 
-    Job(msg, action).run()
+def inputs_digest(cmd: str, inputs: List[str]) -> str:
+    """Return the digest of `cmd` and what is at paths `inputs`.
+
+    A directory counts as the files under it. Links to directories under it
+    count as their targets instead, so that a link into the Nix store changes
+    whenever the store path does.
+    """
+    hasher = hashlib.sha256(cmd.encode("utf-8"))
+    for input in inputs:
+        path = Path(input)
+        hasher.update(f"\0{input}\0{os.path.realpath(path)}\0".encode("utf-8"))
+        if path.is_file():
+            hasher.update(file_digest(path))
+        elif path.is_dir():
+            for rel, entry in walk(path, follow_symlinks=False):
+                hasher.update(f"\0{rel}\0".encode("utf-8"))
+                if entry.is_symlink() and entry.is_dir():
+                    hasher.update(os.readlink(entry.path).encode("utf-8"))
+                elif entry.is_file():
+                    hasher.update(file_digest(Path(entry.path)))
+        else:
+            hasher.update(b"missing")
+    return hasher.hexdigest()
 
 
 def ensure_exe(cmd: str) -> None:
@@ -38,19 +97,28 @@ def ensure_exe(cmd: str) -> None:
 
 
 def run_cmd(
-    cmd: str, opt: Options, cwd: Optional[PathLike] = None, shell: bool = False
+    cmd: str,
+    opt: Options,
+    cwd: Optional[PathLike] = None,
+    shell: bool = False,
+    timeout: Optional[float] = None,
 ) -> int:
     """Run external command `cmd`.
 
-    Hide its `stdout`, redirect its `stderr` to `logging.warning`, and return
-    its exit code.
+    Redirect its `stdout` to `logging.debug` and its `stderr` to
+    `logging.warning`, line by line as they come, prefixed with the program
+    name. Return its exit code.
 
     If `cwd` is not `None`, run the command in that path. If `shell` is `True`,
-    run the command in a shell.
+    run the command in a shell. If `timeout` is not `None`, kill the command
+    after that many seconds and raise `subprocess.TimeoutExpired`. In a dry
+    run, only record the command, and return 0.
     """
     if opt.dry:
+        record_change("run", "command", cmd)
         return 0
 
+    count("commands")
     cmd_or_parts = cmd if shell else cmd.split()
     process = subprocess.Popen(
         cmd_or_parts,
@@ -59,10 +127,37 @@ def run_cmd(
         stdout=subprocess.PIPE,
         stderr=subprocess.PIPE,
         text=True,
+        errors="replace",
     )
-    if process.stderr:
-        while process.poll() is not None:
-            line = process.stderr.readline().strip()
+
+    # Drain both pipes at once, so that neither fills up and blocks the command.
+    prefix = "[{}] ".format(os.path.basename(cmd.split()[0]))
+    drainers = [
+        Thread(target=forward_lines, args=(process.stdout, logging.debug, prefix)),
+        Thread(target=forward_lines, args=(process.stderr, logging.warning, prefix)),
+    ]
+    for drainer in drainers:
+        drainer.daemon = True
+        drainer.start()
+    join_timeout = None
+    try:
+        return process.wait(timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+        # Children of the killed command may keep the pipes open, so don't wait
+        # forever for them.
+        join_timeout = 1.0
+        raise
+    finally:
+        for drainer in drainers:
+            drainer.join(join_timeout)
+
+
+def forward_lines(stream: IO[str], log: Callable[..., None], prefix: str) -> None:
+    """Pass every non-empty line of `stream` to `log`, prefixed with `prefix`."""
+    with stream:
+        for line in stream:
+            line = line.rstrip()
             if line:
-                logging.warning(line)
-    return process.wait()
+                log("%s%s", prefix, line)
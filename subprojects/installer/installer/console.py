@@ -0,0 +1,186 @@
+"""Console output of jobs, messages and logs.
+
+Output is written in one of three modes:
+
+- "tty": readable lines. On a terminal, while jobs run, its bottom shows a
+  live line for each worker, naming the job it runs.
+- "json": one JSON object per line, for when the output is not a terminal.
+- "quiet": only failures and warnings, formatting nothing else.
+
+Each write is assembled into a single string and written at once under a lock,
+so that the output of concurrent jobs never interleaves. Lines for people are
+flushed at once, while JSON lines are left to the buffering of the stream.
+"""
+
+import json
+import logging
+import shutil
+import sys
+import threading
+from threading import Lock
+from typing import TYPE_CHECKING, Dict, List, Optional, TextIO
+
+from installer.style import Formatter, done_text, failed_text, plain, skipped_text
+
+if TYPE_CHECKING:
+    from installer.job import Job
+
+
+class Console:
+    """Console writing to `stream` in `mode` (see the module docstring)."""
+
+    def __init__(self, mode: str, stream: Optional[TextIO] = None) -> None:
+        self.mode = mode
+        self.stream = stream or sys.stdout
+        # Live lines need a terminal to be redrawn.
+        self.live_lines = mode == "tty" and self.stream.isatty()
+        self.lock = Lock()
+        # Message of the job each worker thread is running.
+        self.live: Dict[int, str] = {}
+        # Number of live lines currently on the terminal.
+        self.drawn = 0
+        self.formatter = Formatter()
+
+    def job_started(self, job: "Job") -> None:
+        """Show that `job` has started in the current thread."""
+        if not self.live_lines:
+            return
+        with self.lock:
+            self.live[threading.get_ident()] = job.msg
+            self._write_lines([])
+
+    def job_finished(self, job: "Job", note: Optional[str] = None) -> None:
+        """Show that `job` has finished, with `note` if any."""
+        if self.mode == "json":
+            record = {
+                "event": "job",
+                "job": plain(job.msg),
+                "status": "done" if job.ok else "failed",
+                "seconds": round((job.end or 0) - (job.start or 0), 6),
+            }
+            if note:
+                record["note"] = plain(note)
+            self._write_json(record)
+        elif self.mode == "tty" or not job.ok:
+            text = done_text(note) if job.ok else failed_text()
+            with self.lock:
+                self.live.pop(threading.get_ident(), None)
+                self._write_lines([job.msg + "..." + text])
+
+    def job_skipped(self, job: "Job") -> None:
+        """Show that `job` is skipped, since a dependency has failed."""
+        if self.mode == "json":
+            self._write_json(
+                {"event": "job", "job": plain(job.msg), "status": "skipped"}
+            )
+        elif self.mode == "tty":
+            with self.lock:
+                self._write_lines([job.msg + "..." + skipped_text()])
+
+    def message(self, text: str) -> None:
+        """Show `text`, a message not related to any job."""
+        if self.mode == "json":
+            self._write_json({"event": "message", "text": plain(text)})
+        elif self.mode == "tty":
+            with self.lock:
+                self._write_lines([text])
+
+    def event(self, record: dict, text: Optional[str] = None) -> None:
+        """Show `record` as JSON, or `text` if any to people."""
+        if self.mode == "json":
+            self._write_json(record)
+        elif self.mode == "tty" and text is not None:
+            with self.lock:
+                self._write_lines([text])
+
+    def log(self, record: logging.LogRecord) -> None:
+        """Show log `record`."""
+        if self.mode == "json":
+            self._write_json(
+                {
+                    "event": "log",
+                    "level": record.levelname.lower(),
+                    "message": plain(record.getMessage()),
+                }
+            )
+        else:
+            line = self.formatter.format(record)
+            with self.lock:
+                self._write_lines([line])
+
+    def write(self, text: str) -> None:
+        """Write `text`, which is output of another console in the same mode."""
+        with self.lock:
+            if self.mode == "json":
+                self.stream.write(text)
+            else:
+                self._write_lines(text.splitlines())
+
+    def _write_json(self, record: dict) -> None:
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            self.stream.write(line)
+
+    def _write_lines(self, lines: List[str]) -> None:
+        # Erase live lines, write `lines` above them, and draw them again.
+        parts = []
+        if self.drawn:
+            parts.append(f"\u001b[{self.drawn}F\u001b[J")
+        parts.extend(line + "\n" for line in lines)
+        if self.live_lines:
+            width = shutil.get_terminal_size().columns - 1
+            for msg in self.live.values():
+                line = msg + "..."
+                if len(plain(line)) > width:
+                    line = plain(line)[: width - 3] + "..."
+                parts.append(line + "\n")
+            self.drawn = len(self.live)
+        self.stream.write("".join(parts))
+        self.stream.flush()
+
+
+class ConsoleHandler(logging.Handler):
+    """Logging handler showing records via the console."""
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            get_console().log(record)
+        except Exception:
+            self.handleError(record)
+
+
+# The console of the current run, created when first needed.
+_console: Optional[Console] = None
+
+
+def get_console() -> Console:
+    """Return the console of the current run."""
+    global _console
+    if _console is None:
+        _console = Console(default_mode())
+    return _console
+
+
+def default_mode() -> str:
+    """Return \"tty\" if the standard output is a terminal, or \"json\"."""
+    return "tty" if sys.stdout.isatty() else "json"
+
+
+
+def setup_console(
+    mode: Optional[str] = None, debug: bool = False, stream: Optional[TextIO] = None
+) -> None:
+    """Set up the console writing to `stream` in `mode`, and route logging to it.
+
+    `mode` defaults to `default_mode`. Records below the active level are
+    dropped by `logging` before they are formatted, so debug messages cost
+    nothing unless `debug`.
+    """
+    global _console
+    _console = Console(mode or default_mode(), stream)
+    logger = logging.getLogger()
+    for handler in list(logger.handlers):
+        if isinstance(handler, ConsoleHandler):
+            logger.removeHandler(handler)
+    logger.addHandler(ConsoleHandler())
+    logger.setLevel(logging.DEBUG if debug else logging.WARNING)
@@ -0,0 +1,99 @@
+"""Changes that a dry run finds to be needed.
+
+In a dry run, jobs walk their sources and check their destinations just like in
+a real run (including the quick check against the recorded state), but record
+what they would do here instead of doing it. The result tells exactly what a
+real run would change, and how much it would copy.
+"""
+
+from dataclasses import asdict, dataclass
+from threading import Lock
+from typing import Dict, List
+
+from installer.console import get_console
+from installer.style import emph, emph_cmd, emph_path
+
+
+@dataclass
+class Change:
+    """A change to a destination, or a command to run."""
+
+    # What would be done: "create", "replace", "skip" or "run".
+    action: str
+    # What is made: "link", "copy", "dir" or "command".
+    kind: str
+    # The destination path, or the command.
+    target: str
+    # Bytes to copy.
+    size: int = 0
+
+
+class Diff:
+    """Changes recorded by jobs, possibly from many threads."""
+
+    def __init__(self) -> None:
+        self.lock = Lock()
+        self.changes: List[Change] = []
+
+    def add(self, action: str, kind: str, target: str, size: int = 0) -> None:
+        """Record a change."""
+        with self.lock:
+            self.changes.append(Change(action, kind, target, size))
+
+    def summary(self) -> Dict[str, int]:
+        """Return the number of changes of each action, and bytes to copy."""
+        summary = {"create": 0, "replace": 0, "skip": 0, "run": 0, "bytes": 0}
+        with self.lock:
+            for change in self.changes:
+                summary[change.action] += 1
+                summary["bytes"] += change.size
+        return summary
+
+    def report(self) -> None:
+        """Show every change to be made, and the summary.
+
+        As JSON, every destination checked is shown, including skipped ones.
+        """
+        console = get_console()
+        with self.lock:
+            changes = list(self.changes)
+        for change in changes:
+            if change.action == "run":
+                text = "run " + emph_cmd(change.target)
+            elif change.action != "skip":
+                text = f"{change.action} {change.kind} {emph_path(change.target)}"
+            else:
+                text = None
+            console.event(dict(event="change", **asdict(change)), text)
+        summary = self.summary()
+        text = (
+            "{}: {create} to create, {replace} to replace, {skip} unchanged, "
+            "{run} commands to run, {size} to copy."
+        ).format(emph("Plan"), size=format_size(summary["bytes"]), **summary)
+        console.event(dict(event="plan", **summary), text)
+
+
+def format_size(size: int) -> str:
+    """Return `size` in bytes in a readable unit."""
+    if size < 1024:
+        return f"{size} B"
+    value = size / 1024
+    for unit in ("KiB", "MiB"):
+        if value < 1024:
+            return f"{value:.1f} {unit}"
+        value /= 1024
+    return f"{value:.1f} GiB"
+
+
+# Changes recorded in the current run.
+_diff = Diff()
+
+
+def get_diff() -> Diff:
+    """Return the changes recorded in the current run."""
+    return _diff
+
+
+def record_change(action: str, kind: str, target: str, size: int = 0) -> None:
+    """Record a change found by a dry run, see `Change`."""
+    _diff.add(action, kind, target, size)
@@ -0,0 +1,138 @@
+"""Installation into many home directories at once.
+
+Each target home directory (a "root") is installed into by its own process, in
+which "~" and the per-user directories of Windows point into the root, so that
+everything (including the cache, state and journal) belongs to the root. The
+sources are scanned and hashed once beforehand and shared with every process.
+
+Processes are never reused, so that nothing of one root leaks into another.
+They are forked where possible, which neither imports the main module again nor
+pickles the shared sources; on Windows they can only be spawned.
+"""
+
+import io
+import logging
+import multiprocessing
+import os
+from pathlib import Path
+from typing import List, Tuple
+
+from installer.console import get_console, setup_console
+from installer.diff import get_diff
+from installer.file import copy_summary, scan_sources, share_sources
+from installer.journal import get_journal
+from installer.opt import Options
+from installer.os import IS_WINDOWS
+from installer.path import to_path
+from installer.plan import load_plan
+from installer.sched import Scheduler
+from installer.state import save_state
+from installer.style import emph_path, failed_text
+
+
+def read_roots(args: List[str]) -> List[Path]:
+    """Return roots given by `args`.
+
+    An argument like "@FILE" stands for the roots listed in FILE, one per line,
+    where empty lines and lines starting with "#" are ignored.
+    """
+    roots = []
+    for arg in args:
+        if arg.startswith("@"):
+            with open(to_path(arg[1:]), "r") as f:
+                lines = [line.strip() for line in f]
+            roots += [
+                to_path(line) for line in lines if line and not line.startswith("#")
+            ]
+        else:
+            roots.append(to_path(arg))
+    return roots
+
+
+def enter_root(root: Path) -> None:
+    """Make root `root` the home directory of the current process."""
+    os.environ["HOME"] = str(root)
+    os.environ["USERPROFILE"] = str(root)
+    # The cache must be in the root too.
+    os.environ.pop("XDG_CACHE_HOME", None)
+    if IS_WINDOWS:
+        drive, path = os.path.splitdrive(str(root))
+        os.environ["HOMEDRIVE"] = drive
+        os.environ["HOMEPATH"] = path
+        os.environ["APPDATA"] = str(root.joinpath("AppData", "Roaming"))
+        os.environ["LOCALAPPDATA"] = str(root.joinpath("AppData", "Local"))
+
+
+def install_roots(roots: List[Path], opt: Options, debug: bool = False) -> int:
+    """Install into every root in `roots` concurrently.
+
+    Show the output of each root as it finishes, and return the number of roots
+    with failed jobs.
+    """
+    console = get_console()
+
+    # Scan sources once for all roots. Only copied sources are hashed, since
+    # links need no hash.
+    plan = [
+        entry
+        for entry in load_plan("./install.json")
+        if entry.kind in ("link", "copy") and Path(entry.src_path).exists()
+    ]
+    trees, digests = scan_sources(
+        [Path(entry.src_path) for entry in plan],
+        [Path(entry.src_path) for entry in plan if entry.kind == "copy"],
+    )
+    failed = 0
+    processes = min(len(roots), os.cpu_count() or 1)
+    context = multiprocessing.get_context("spawn" if IS_WINDOWS else "fork")
+    with context.Pool(
+        processes,
+        initializer=share_sources,
+        initargs=(trees, digests),
+        maxtasksperchild=1,
+    ) as pool:
+        tasks = [(root, opt, console.mode, debug) for root in roots]
+        for root, ok, output in pool.imap_unordered(install_root, tasks):
+            if ok:
+                console.message(f"Installed into {emph_path(root)}:")
+            else:
+                console.message(f"Installing into {emph_path(root)}...{failed_text()}")
+                failed += 1
+            console.write(output)
+    console.message(f"Installed into {len(roots) - failed} of {len(roots)} roots.")
+    return failed
+
+
+def install_root(task: Tuple[Path, Options, str, bool]) -> Tuple[Path, bool, str]:
+    """Install into a root, in a process of its own.
+
+    `task` is the root, options, the console mode and whether to debug. Return
+    the root, whether every job succeeded, and the output.
+    """
+    from installer import schedule_install
+
+    root, opt, mode, debug = task
+    enter_root(root)
+    output = io.StringIO()
+    setup_console(mode, debug, output)
+    ok = False
+    try:
+        # Keep what an interrupted run has done.
+        journal = get_journal()
+        if journal.interrupted() and not opt.dry:
+            journal.commit()
+        sched = Scheduler(opt.jobs)
+        schedule_install(sched, opt)
+        sched.run()
+        save_state()
+        if not opt.dry:
+            journal.commit()
+        else:
+            get_diff().report()
+        summary = copy_summary(sched.queue)
+        if summary is not None:
+            get_console().message(summary)
+        ok = all(job.ok for job in sched.queue)
+    except Exception as e:
+        logging.error(e)
+    return root, ok, output.getvalue()
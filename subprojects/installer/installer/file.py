@@ -1,42 +1,81 @@
 """Utility for file operations."""
 
+import hashlib
 import logging
 import os
 import shutil
+import sys
 from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
 
-from installer.job import Job
+from installer.diff import record_change
+from installer.job import Job, count
+from installer.journal import get_journal, tmp_path
 from installer.opt import Options
+from installer.os import IS_WINDOWS
 from installer.path import to_paths
+from installer.state import get_state, stat_key
 from installer.style import emph_path
+from installer.walk import walk
 
+# Size of blocks to read at a time when hashing or copying files.
+BLOCK_SIZE = 1024 * 1024
 
-def copy(src: str, dst: str, opt: Options) -> None:
-    """Copy `src` to `dst`, handling errors."""
+# Strategies to copy a file, from the cheapest, see `place_copy`.
+COPY_STRATEGIES = ("reflink", "hardlink", "copy")
+
+# Counters of files copied by each strategy.
+COPY_COUNTERS = {
+    "reflink": "files_reflinked",
+    "hardlink": "files_hardlinked",
+    "copy": "files_copied",
+}
+
+# The `ioctl` request cloning a file on Linux, from <linux/fs.h>.
+FICLONE = 0x40049409
+
+# Strategies found to work for pairs of source and destination devices.
+_strategies: Dict[Tuple[int, int], str] = {}
+
+# Trees and digests of sources scanned once for many runs, see `share_sources`.
+_shared_trees: Dict[str, List[Tuple[str, bool]]] = {}
+_shared_digests: Dict[str, Tuple[List[int], bytes]] = {}
+
+
+def copy(
+    src: str, dst: str, opt: Options, resolved: Optional[Tuple[Path, Path]] = None
+) -> Job:
+    """Return a job copying `src` to `dst`, handling errors.
+
+    If `resolved` is not `None`, it is used as the resolved `src` and `dst`.
+    """
     msg = f"Copying {emph_path(src)} to {emph_path(dst)}"
 
     def action() -> None:
-        src_path, dst_path = to_paths(src, dst)
+        src_path, dst_path = resolved or to_paths(src, dst)
         prepare_paths(src_path, dst_path, opt)
         copy_path(src_path, dst_path, opt)
-        
-    Job(msg, action).run()
+
+    return Job(msg, action)
 
 
-def link(src: str, dst: str, opt: Options) -> None:
-    """Link to `src` as `dst`, handling errors.
+def link(
+    src: str, dst: str, opt: Options, resolved: Optional[Tuple[Path, Path]] = None
+) -> Job:
+    """Return a job linking to `src` as `dst`, handling errors.
 
     If `src` is a directory, create a directory of symbolic links, instead of a
-    single symbolic link.
+    single symbolic link. If `resolved` is not `None`, it is used as the
+    resolved `src` and `dst`.
     """
     msg = f"Linking to {emph_path(src)} as {emph_path(dst)}"
 
     def action() -> None:
-        src_path, dst_path = to_paths(src, dst)
+        src_path, dst_path = resolved or to_paths(src, dst)
         prepare_paths(src_path, dst_path, opt)
         link_path(src_path, dst_path, opt)
-        
-    Job(msg, action).run()
+
+    return Job(msg, action)
 
 
 def prepare_paths(src_path: Path, dst_path: Path, opt: Options) -> None:
@@ -46,76 +85,462 @@ def prepare_paths(src_path: Path, dst_path: Path, opt: Options) -> None:
         raise FileExistsError(f"{emph_path(src_path)} does not exist")
 
     # If the destination directory does not exist, create directories.
-    if not dst_path.parent.exists() and not opt.dry:
-        os.makedirs(dst_path.parent)
+    if not dst_path.parent.exists():
+        if opt.dry:
+            record_change("create", "dir", str(dst_path.parent))
+        else:
+            # Other jobs may be making it at the same time.
+            os.makedirs(dst_path.parent, exist_ok=True)
 
 
 def copy_path(src_path: Path, dst_path: Path, opt: Options) -> None:
-    """Copy `src_path` to `dst_path`."""
-    if opt.dry:
-        return
+    """Copy `src_path` to `dst_path`.
 
+    In a dry run, only record what would change.
+    """
     # Copy recursively while copying permissions and times.
-    copy_recursively(src_path, dst_path)
+    copy_recursively(src_path, dst_path, opt.dry, opt.copy_strategy)
 
 
 def link_path(src_path: Path, dst_path: Path, opt: Options) -> None:
     """Link to `src_path` as `dst_path`.
 
-    Fall back to copying if permission is insufficient.
+    If `opt.dir_links` is set and `src_path` is a directory, try to link the
+    whole directory at once via `link_dir`. Fall back to copying if permission
+    is insufficient. In a dry run, only record what would change.
     """
+    # A link to the whole directory is fine either way, and linking file-wise
+    # through it would replace the sources themselves.
+    if src_path.is_dir() and is_link_to(dst_path, src_path):
+        logging.debug("%s is already the correct symlink", emph_path(dst_path))
+        if opt.dry:
+            record_change("skip", "link", str(dst_path))
+        return
+
     if opt.dry:
+        if opt.dir_links and src_path.is_dir() and can_link_dir(src_path, dst_path):
+            plan_write("link", src_path, dst_path)
+        else:
+            link_recursively(src_path, dst_path, dry=True)
         return
 
     try:
         # Try to create symbolic link(s).
+        if opt.dir_links and src_path.is_dir() and link_dir(src_path, dst_path):
+            return
         link_recursively(src_path, dst_path)
     except OSError:
         # Fall back to copying.
         logging.debug("Fall back to copying")
-        copy_recursively(src_path, dst_path)
+        copy_recursively(src_path, dst_path, strategy=opt.copy_strategy)
 
 
-def copy_recursively(src_path: Path, dst_path: Path) -> None:
-    """Recursively copy `src_path` to `dst_path`."""
-    if src_path.is_file():
-        # Remove destination if it exists.
-        if dst_path.exists():
-            dst_path.unlink()
-        # Copy the file including its metadata.
-        shutil.copy2(src_path, dst_path)
-    else:
-        # Make destination directory if it does not exist.
-        if not dst_path.exists():
-            os.makedirs(dst_path)
-        # Copy everything in the source.
-        for entry in src_path.iterdir():
-            entry_dst = dst_path.joinpath(entry.name)
-            copy_recursively(entry, entry_dst)
+def copy_recursively(
+    src_path: Path, dst_path: Path, dry: bool = False, strategy: str = "auto"
+) -> None:
+    """Recursively copy `src_path` to `dst_path` by `strategy`.
+
+    If `dry`, only record what would change. See `place_copy` for `strategy`.
+    """
+    for src, dst, is_dir in tree_pairs(src_path, dst_path):
+        if is_dir:
+            make_dir(dst, dry)
+        else:
+            copy_entry(src, dst, dry, strategy)
 
 
-def link_recursively(src_path: Path, dst_path: Path) -> None:
+def link_recursively(src_path: Path, dst_path: Path, dry: bool = False) -> None:
     """File-wise linking.
 
     If `src_path` is a file, make `dst_path` its symbolic link. Otherwise create
     a directory as `dst_path` and create symbolic links of files in `src_path`
-    inside it.
+    inside it. If `dry`, only record what would change.
+    """
+    for src, dst, is_dir in tree_pairs(src_path, dst_path):
+        if is_dir:
+            make_dir(dst, dry)
+        else:
+            link_entry(src, dst, dry)
+
+
+def make_dir(path: Path, dry: bool = False) -> None:
+    """Make directory `path` if it does not exist, or record it if `dry`."""
+    if not os.path.isdir(path):
+        if dry:
+            record_change("create", "dir", str(path))
+        else:
+            os.makedirs(path, exist_ok=True)
+
+
+def link_dir(src_path: Path, dst_path: Path) -> bool:
+    """Make `dst_path` a single link to directory `src_path`, if possible.
+
+    This is possible if `dst_path` does not exist, or is a directory holding
+    nothing but symbolic links to files in `src_path` (as made by
+    `link_recursively`), which the journal moves away as a backup. On Windows,
+    a junction is made if a symbolic link is not permitted.
+
+    Return `True` if the link is made.
+    """
+    if not can_link_dir(src_path, dst_path):
+        return False
+    tmp = tmp_path(dst_path)
+    try:
+        os.symlink(src_path, tmp, target_is_directory=True)
+    except OSError:
+        if not IS_WINDOWS:
+            raise
+        import _winapi
+
+        _winapi.CreateJunction(str(src_path), str(tmp))
+    # The directory holds only links, as checked by `can_link_dir`.
+    get_journal().replace(tmp, dst_path, replace_dir=True)
+    count("files_written")
+    return True
+
+
+def can_link_dir(src_path: Path, dst_path: Path) -> bool:
+    """Return `True` if `link_dir` can link `dst_path` to `src_path`."""
+    if not os.path.lexists(dst_path):
+        return True
+    return not dst_path.is_symlink() and holds_only_links_to(dst_path, src_path)
+
+
+def is_link_to(path: Path, target: Path) -> bool:
+    """Return `True` if `path` is a symbolic link or junction to `target`."""
+    try:
+        os.readlink(path)
+    except (OSError, ValueError):
+        return False
+    return path.resolve() == target.resolve()
+
+
+def holds_only_links_to(dir: Path, src_path: Path) -> bool:
+    """Return `True` if every file in `dir` is a symbolic link into `src_path`."""
+    src_real = os.path.realpath(src_path)
+    for _, entry in walk(dir, follow_symlinks=False):
+        if entry.is_symlink():
+            target = os.path.realpath(entry.path)
+            if os.path.commonpath([src_real, target]) != src_real:
+                return False
+        elif not entry.is_dir(follow_symlinks=False):
+            return False
+    return True
+
+
+def tree_pairs(src_path: Path, dst_path: Path) -> Iterator[Tuple[Path, Path, bool]]:
+    """Yield every path in `src_path` with its counterpart in `dst_path`.
+
+    Also yield whether the path is a directory. If `src_path` is a directory,
+    it is yielded first, and every directory comes before its content.
     """
     if src_path.is_file():
-        # Skip if destination is already the correct symlink.
-        if dst_path.is_symlink() and dst_path.resolve().samefile(src_path):
-            logging.debug(f"{emph_path(dst_path)} is already the correct symlink")
-            return
-        # Remove destination if it exists.
-        if dst_path.exists():
-            dst_path.unlink()
-        # Create the symbolic link.
-        os.symlink(src_path, dst_path, target_is_directory=False)
+        yield src_path, dst_path, False
+        return
+    yield src_path, dst_path, True
+    tree = _shared_trees.get(str(src_path))
+    if tree is not None:
+        for rel, is_dir in tree:
+            yield src_path.joinpath(rel), dst_path.joinpath(rel), is_dir
+        return
+    for rel, entry in walk(src_path):
+        yield Path(entry.path), dst_path.joinpath(rel), entry.is_dir()
+
+
+def scan_sources(
+    src_paths: List[Path], digest_paths: List[Path]
+) -> Tuple[Dict[str, List[Tuple[str, bool]]], Dict[str, Tuple[List[int], bytes]]]:
+    """Scan the trees of `src_paths` and digest files in `digest_paths`.
+
+    Directories in `digest_paths` are digested file by file. Return the trees
+    and digests, which can be passed to `share_sources`.
+    """
+    trees = {
+        str(path): [(rel, entry.is_dir()) for rel, entry in walk(path)]
+        for path in src_paths
+        if path.is_dir()
+    }
+    digests = {}
+    for path in digest_paths:
+        for src, _, is_dir in tree_pairs(path, path):
+            if not is_dir:
+                digests[str(src)] = (stat_key(os.stat(src)), file_digest(src))
+    return trees, digests
+
+
+def share_sources(
+    trees: Dict[str, List[Tuple[str, bool]]],
+    digests: Dict[str, Tuple[List[int], bytes]],
+) -> None:
+    """Use `trees` and `digests` from `scan_sources` instead of scanning again.
+
+    Digests are only used for files whose stats have not changed since.
+    """
+    _shared_trees.update(trees)
+    _shared_digests.update(digests)
+
+
+def copy_entry(
+    src_path: Path, dst_path: Path, dry: bool = False, strategy: str = "auto"
+) -> None:
+    """Copy file `src_path` to `dst_path`, or record the change if `dry`.
+
+    See `place_copy` for `strategy`.
+    """
+    count("files_checked")
+    # Skip if the destination is recorded as an up-to-date copy.
+    state = get_state()
+    if state.is_current(src_path, dst_path, "copy"):
+        if dry:
+            record_change("skip", "copy", str(dst_path))
+        return
+    # Copy the file including its metadata, unless it is identical.
+    copy_file(src_path, dst_path, dry, strategy)
+    if not dry:
+        state.record(src_path, dst_path, "copy")
+
+
+def link_entry(src_path: Path, dst_path: Path, dry: bool = False) -> None:
+    """Make `dst_path` a symbolic link to file `src_path`.
+
+    If `dry`, only record the change.
+    """
+    count("files_checked")
+    # Skip if the destination is recorded as an up-to-date symlink.
+    state = get_state()
+    if state.is_current(src_path, dst_path, "link"):
+        if dry:
+            record_change("skip", "link", str(dst_path))
+        return
+    # Skip if destination is already the correct symlink.
+    if dst_path.is_symlink() and dst_path.resolve().samefile(src_path):
+        logging.debug("%s is already the correct symlink", emph_path(dst_path))
+        if dry:
+            record_change("skip", "link", str(dst_path))
+        else:
+            state.record(src_path, dst_path, "link")
+        return
+    if dry:
+        plan_write("link", src_path, dst_path)
+        return
+    # Create the symbolic link, replacing the destination.
+    tmp = tmp_path(dst_path)
+    os.symlink(src_path, tmp, target_is_directory=False)
+    get_journal().replace(tmp, dst_path)
+    count("files_written")
+    state.record(src_path, dst_path, "link")
+
+
+def copy_file(
+    src_path: Path, dst_path: Path, dry: bool = False, strategy: str = "auto"
+) -> bool:
+    """Copy file `src_path` to `dst_path` with its metadata.
+
+    Skip copying if `dst_path` is a file identical to `src_path`. Return `True`
+    if the file is actually copied, or would be if `dry`. See `place_copy` for
+    `strategy`.
+    """
+    if not dst_path.is_symlink() and dst_path.is_file():
+        if same_content(src_path, dst_path, sync=not dry):
+            logging.debug("%s is already identical", emph_path(dst_path))
+            if dry:
+                record_change("skip", "copy", str(dst_path))
+            return False
+    if dry:
+        plan_write("copy", src_path, dst_path)
+        return True
+    # Copy to a temporary file, and then replace the destination.
+    tmp = tmp_path(dst_path)
+    used = place_copy(src_path, tmp, strategy)
+    get_journal().replace(tmp, dst_path)
+    count("files_written")
+    count(COPY_COUNTERS[used])
+    if used == "copy":
+        count("bytes_copied", os.stat(dst_path).st_size)
+    return True
+
+
+def place_copy(src_path: Path, dst_path: Path, strategy: str = "auto") -> str:
+    """Make new file `dst_path` a copy of `src_path`, returning how.
+
+    `strategy` is one of `COPY_STRATEGIES`, falling back to "copy" if it is not
+    possible, or "auto". With "auto", the cheapest strategy working for the
+    devices of the paths is used: a reflink shares the data until either file
+    is changed, and a hard link (only possible on the same device) is the very
+    same file. The working strategy is remembered for the pair of devices.
+    """
+    pair = None
+    if strategy == "auto":
+        pair = (os.stat(src_path).st_dev, os.stat(dst_path.parent).st_dev)
+        known = _strategies.get(pair)
+        candidates = [known] if known else list(COPY_STRATEGIES)
     else:
-        # Make destination directory if it does not exist.
-        if not dst_path.exists():
-            os.makedirs(dst_path)
-        # Link everything in the source.
-        for entry in src_path.iterdir():
-            entry_dst = dst_path.joinpath(entry.name)
-            link_recursively(entry, entry_dst)
+        candidates = [strategy]
+    if "copy" not in candidates:
+        candidates.append("copy")
+    for candidate in candidates:
+        if _place_copy(src_path, dst_path, candidate):
+            if pair is not None:
+                _strategies[pair] = candidate
+            return candidate
+    raise Exception(f"Cannot copy {emph_path(src_path)}")
+
+
+def _place_copy(src_path: Path, dst_path: Path, strategy: str) -> bool:
+    """Copy `src_path` as `dst_path` by `strategy`, or return `False`.
+
+    Errors of a regular copy are raised instead.
+    """
+    try:
+        if strategy == "hardlink":
+            os.link(src_path, dst_path)
+            return True
+        if strategy == "reflink":
+            if not _reflink(src_path, dst_path):
+                return False
+        else:
+            copy_data(src_path, dst_path)
+        shutil.copystat(src_path, dst_path)
+        return True
+    except OSError:
+        if strategy == "copy":
+            raise
+        if os.path.lexists(dst_path):
+            os.unlink(dst_path)
+        return False
+
+
+def _reflink(src_path: Path, dst_path: Path) -> bool:
+    """Clone `src_path` as new file `dst_path` via `FICLONE`, if on Linux."""
+    if not sys.platform.startswith("linux"):
+        return False
+    import fcntl
+
+    with open(src_path, "rb") as fsrc, open(dst_path, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+    return True
+
+
+def copy_summary(jobs: List[Job]) -> Optional[str]:
+    """Return how many files `jobs` have copied by each strategy, if any."""
+    totals = {
+        strategy: sum(job.counters.get(name, 0) for job in jobs)
+        for strategy, name in COPY_COUNTERS.items()
+    }
+    if not any(totals.values()):
+        return None
+    parts = [f"{n} by {strategy}" for strategy, n in totals.items() if n]
+    return "Copied {} files: {}.".format(sum(totals.values()), ", ".join(parts))
+
+
+def same_content(path1: Path, path2: Path, sync: bool = True) -> bool:
+    """Return `True` if files `path1` and `path2` have the same content.
+
+    Files of different sizes differ, and files of the same size and
+    modification time are assumed identical. Otherwise compare their hashes,
+    and if `sync`, synchronize their modification times if they turn out
+    identical, so that the hashes are not needed next time.
+    """
+    st1, st2 = os.stat(path1), os.stat(path2)
+    if st1.st_size != st2.st_size:
+        return False
+    if st1.st_mtime_ns == st2.st_mtime_ns:
+        return True
+    if file_digest(path1) != file_digest(path2):
+        return False
+    if sync:
+        os.utime(path2, ns=(st1.st_atime_ns, st1.st_mtime_ns))
+    return True
+
+
+def plan_write(kind: str, src_path: Path, dst_path: Path) -> None:
+    """Record that `dst_path` would be made from `src_path` as `kind`."""
+    action = "replace" if os.path.lexists(dst_path) else "create"
+    size = os.stat(src_path).st_size if kind == "copy" else 0
+    record_change(action, kind, str(dst_path), size)
+
+
+def file_digest(path: Path) -> bytes:
+    """Return the BLAKE2 digest of the content of `path`."""
+    shared = _shared_digests.get(str(path))
+    if shared is not None and shared[0] == stat_key(os.stat(path)):
+        return shared[1]
+    hasher = hashlib.blake2b()
+    with open(path, "rb") as f:
+        while block := f.read(BLOCK_SIZE):
+            hasher.update(block)
+    return hasher.digest()
+
+
+def write_file(path: Path, content: str, dry: bool = False) -> bool:
+    """Write `content` to file `path` atomically, returning whether it is written.
+
+    If `path` already has the content, it is left alone. In a dry run, only
+    record the change.
+    """
+    try:
+        with open(path, "r") as f:
+            unchanged = f.read() == content
+    except (OSError, UnicodeDecodeError):
+        unchanged = False
+    if unchanged:
+        if dry:
+            record_change("skip", "copy", str(path))
+        return False
+    if dry:
+        action = "replace" if os.path.lexists(path) else "create"
+        record_change(action, "copy", str(path), len(content.encode()))
+        return True
+    tmp = tmp_path(path)
+    with open(tmp, "w") as f:
+        f.write(content)
+    get_journal().replace(tmp, path)
+    count("files_written")
+    return True
+
+
+def copy_data(src_path: Path, dst_path: Path) -> None:
+    """Copy the content of `src_path` to a new file `dst_path`.
+
+    Let the kernel copy the data via `os.copy_file_range` or `os.sendfile` if
+    available, avoiding copying it through user space.
+    """
+    with open(src_path, "rb") as fsrc, open(dst_path, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        for kernel_copy in (_copy_file_range, _sendfile):
+            try:
+                if kernel_copy(fsrc.fileno(), fdst.fileno(), size):
+                    return
+            except OSError:
+                pass
+            # Start over with the next method.
+            fsrc.seek(0)
+            fdst.seek(0)
+            fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst, BLOCK_SIZE)
+
+
+def _copy_file_range(src_fd: int, dst_fd: int, size: int) -> bool:
+    """Copy `size` bytes with `os.copy_file_range`, if available."""
+    if not hasattr(os, "copy_file_range"):
+        return False
+    copied = 0
+    while copied < size:
+        n = os.copy_file_range(src_fd, dst_fd, size - copied)
+        if n == 0:
+            break
+        copied += n
+    return copied == size
+
+
+def _sendfile(src_fd: int, dst_fd: int, size: int) -> bool:
+    """Copy `size` bytes with `os.sendfile`, if it supports files on this OS."""
+    if not hasattr(os, "sendfile") or not sys.platform.startswith("linux"):
+        return False
+    copied = 0
+    while copied < size:
+        n = os.sendfile(dst_fd, src_fd, copied, size - copied)
+        if n == 0:
+            break
+        copied += n
+    return copied == size
@@ -1,111 +1,450 @@
 """Utility for installing fonts."""
 
+import logging
 import os
 import shutil
+import threading
+import time
 import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from tempfile import TemporaryDirectory
-from typing import List
+from typing import IO, Callable, Dict, List, Optional, Tuple
 
-from installer.cmd import run_cmd
-from installer.job import Job
+from installer.cmd import ensure_exe, run_cmd
+from installer.console import get_console
+from installer.diff import record_change
+from installer.file import BLOCK_SIZE, copy_file
+from installer.job import Job, count, current_job, set_current_job
+from installer.journal import get_journal, tmp_path
 from installer.opt import Options
 from installer.os import IS_LINUX, IS_WINDOWS
 from installer.path import some_path
-from installer.style import emph_path
+from installer.sfnt import FontIndex, FontMeta
+from installer.style import emph_cmd, emph_path
+from installer.walk import walk
 
+# Extensions of font files.
+FONT_EXTS = {".ttc", ".ttf", ".otc", ".otf"}
 
-def install_zyfonts(opt: Options) -> None:
-    """Install all fonts in "ZyFonts.zip", handling errors."""
+
+def install_zyfonts(opt: Options) -> List[Job]:
+    """Return jobs installing all fonts in "ZyFonts.zip", handling errors.
+
+    Duplicated fonts, and fonts already installed from elsewhere in the same or
+    a newer version, are skipped.
+
+    On Linux, the font cache is refreshed by a separate job after installation,
+    if any font has changed.
+    """
     msg = "Installing fonts in {}".format(emph_path("ZyFonts.zip"))
+    changed: List[int] = []
+
+    def action() -> str:
+        changed.append(install_fonts_from(find_zyfonts(), opt))
+        skipped = install.counters.get("fonts_skipped", 0)
+        if skipped:
+            return f"{changed[0]} changed, {skipped} skipped"
+        return f"{changed[0]} changed"
 
-    def action() -> None:
-        tempdir = TemporaryDirectory()
-        tempdir_path = Path(tempdir.name)
-        extracted = extract_zyfonts(tempdir_path)
-        install_fonts_in(extracted, opt)
+    install = Job(msg, action)
+    if IS_LINUX:
+        msg = "Refreshing the font cache"
+        refresh = Job(msg, lambda: refresh_font_cache(changed[0], opt), [install])
+        return [install, refresh]
+    return [install]
 
-    Job(msg, action).run()
-    fontdir = Path.home().joinpath("Downloads/fonts_extracted")
-    print("You should manually install fonts in {}".format(emph_path(fontdir)))
 
+def print_zyfonts_hint() -> None:
+    """Show where to manually install fonts from on Windows."""
+    get_console().message(
+        "You should manually install fonts in {}".format(emph_path(font_dir()))
+    )
 
-def extract_zyfonts(tempdir: Path) -> Path:
-    """Extract "ZyFonts.zip", preferably to `tempdir`.
 
-    If there is already an extracted "ZyFonts" directory, use that instead.
+def find_zyfonts() -> Path:
+    """Find "ZyFonts.zip".
 
-    Return the directory.
+    If there is already an extracted "ZyFonts" directory, return that instead.
     """
-    # Maybe there is already an unzipped "ZyFonts" directory.
-    zyfonts_unzipped = some_path(
+    # Prefer an unzipped "ZyFonts" directory to the zip archive.
+    zyfonts = some_path(
         "~/Downloads/ZyFonts",
         "/mnt/c/Users/zyxir/Downloads/ZyFonts",
+        "~/Downloads/ZyFonts.zip",
+        "~/Zyspace/pcsetup/ZyFonts.zip",
+        "/mnt/c/Users/zyxir/Downloads/ZyFonts.zip",
+        "/mnt/c/Users/zyxir/Zyspace/pcsetup/ZyFonts.zip",
     )
+    if zyfonts is None:
+        raise Exception("Cannot find ZyFonts.zip")
+    return zyfonts
+
 
-    # If not, find the zip archive and unzip it to a temp dir.
-    if zyfonts_unzipped is None:
-        zyfonts = some_path(
-            "~/Downloads/ZyFonts.zip",
-            "~/Zyspace/pcsetup/ZyFonts.zip",
-            "/mnt/c/Users/zyxir/Downloads/ZyFonts.zip",
-            "/mnt/c/Users/zyxir/Zyspace/pcsetup/ZyFonts.zip",
-        )
-        if zyfonts is None:
-            raise Exception("Cannot find ZyFonts.zip")
-        zyfonts_unzipped = tempdir.joinpath("ZyFonts")
-        zyfonts_zip = zipfile.ZipFile(zyfonts, "r")
-        zyfonts_zip.extractall(zyfonts_unzipped)
-
-    # Return the unzipped ZyFonts directory.
-    return zyfonts_unzipped
-
-
-def install_fonts_in(dir: Path, opt: Options) -> None:
-    """Install every font in `dir`."""
-    # Collect all font paths.
-    fonts = []
-    exts = ["ttc", "ttf", "otc", "otf"]
-    for ext in exts:
-        fonts += dir.rglob(f"*.{ext}")
-
-    # Install them in a platform-dependent way.
+def font_dir() -> Path:
+    """Return the directory to install fonts to.
+
+    On Windows, fonts are only put there for manual installation.
+    """
     if IS_LINUX:
-        linux_install_fonts(fonts, opt)
+        return Path("~/.local/share/fonts").expanduser()
     elif IS_WINDOWS:
-        win_install_fonts(fonts, opt)
+        return Path.home().joinpath("Downloads/fonts_extracted")
     else:
         raise OSError("Unsupported system.")
 
 
-def linux_install_fonts(fonts: List[Path], opt: Options) -> None:
-    """Install every font in `fonts` on Linux."""
-    if opt.dry:
-        return
-    fontdir = Path("~/.local/share/fonts").expanduser()
-    os.makedirs(fontdir, exist_ok=True)
-    for font in fonts:
-        font_dst = fontdir.joinpath(font.name)
-        copy_font(font, font_dst)
-    run_cmd("fc-cache -f", opt)
+def refresh_font_cache(changed: int, opt: Options) -> str:
+    """Refresh the font cache of the font directory if `changed` is positive.
+
+    Only the font directory is rescanned, and without "-f", so fontconfig only
+    rescans it if its modification time has changed. Return a note telling how
+    long it took.
+    """
+    if changed == 0:
+        return "no font changed, skipped"
+    cmd = f"fc-cache {font_dir()}"
+    ensure_exe(cmd)
+    start_time = time.time()
+    code = run_cmd(cmd, opt)
+    if code != 0:
+        raise Exception(f"{emph_cmd(cmd)} exited with code {code}")
+    elapsed_time = time.time() - start_time
+    return f"{changed} fonts changed, rebuilt in {elapsed_time:.3f} seconds"
+
+
+def is_font(name: str) -> bool:
+    """Return `True` if file name `name` is of a font."""
+    return os.path.splitext(name)[1].lower() in FONT_EXTS
+
+
+def install_fonts_from(src: Path, opt: Options) -> int:
+    """Install every font in `src`, which is a directory or a zip archive.
+
+    Fonts are deduplicated by their metadata, which is kept in an index in the
+    cache. Return the number of fonts installed or updated, or that would be in a
+    dry run.
+    """
+    fontdir = font_dir()
+    if not opt.dry:
+        os.makedirs(fontdir, exist_ok=True)
+    elif not fontdir.is_dir():
+        record_change("create", "dir", str(fontdir))
+    index = FontIndex()
+    try:
+        if src.is_dir():
+            return install_fonts_in(src, fontdir, opt, index)
+        else:
+            return install_fonts_in_zip(src, fontdir, opt, index)
+    finally:
+        index.save()
+
+
+def install_fonts_in(
+    dir: Path, fontdir: Path, opt: Options, index: Optional[FontIndex] = None
+) -> int:
+    """Install every font in directory `dir` into `fontdir`.
+
+    Fonts are selected by `select_fonts_in`.
+    """
+    fonts = select_fonts_in(dir, fontdir, opt, index)
+    return install_in_parallel(
+        fonts, lambda font: copy_font(font, fontdir.joinpath(font.name), opt), opt
+    )
+
+
+def select_fonts_in(
+    dir: Path, fontdir: Path, opt: Options, index: Optional[FontIndex] = None
+) -> List[Path]:
+    """Return fonts in directory `dir` to be installed into `fontdir`.
+
+    If `index` is given, skip fonts as `select_fonts` does. Of fonts with the
+    same file name, only one is installed (see `unique_names`).
+    """
+    fonts = [
+        Path(entry.path)
+        for _, entry in walk(dir)
+        if is_font(entry.name) and entry.is_file()
+    ]
+    if index is not None:
+        metas = map_in_parallel(fonts, lambda font: file_meta(index, font), opt)
+        installed = installed_fonts(fontdir, index, opt)
+        fonts = select_fonts(fonts, [font.name for font in fonts], metas, installed)
+    return unique_names(fonts, [font.name for font in fonts])
+
+
+def install_fonts_in_zip(
+    zip: Path, fontdir: Path, opt: Options, index: Optional[FontIndex] = None
+) -> int:
+    """Install every font in zip archive `zip` into `fontdir`.
+
+    Fonts are streamed from the archive, without extracting it first. Every
+    worker reads from its own handle of the archive. Fonts are selected by
+    `select_fonts_in_zip`.
+    """
+    handles = ZipHandles(zip)
+
+    def install(info: zipfile.ZipInfo) -> bool:
+        dst = fontdir.joinpath(os.path.basename(info.filename))
+        return extract_font(handles.get(), info, dst, opt.dry)
+
+    try:
+        members = select_fonts_in_zip(handles, fontdir, opt, index)
+        return install_in_parallel(members, install, opt)
+    finally:
+        handles.close()
+
+
+def select_fonts_in_zip(
+    handles: "ZipHandles",
+    fontdir: Path,
+    opt: Options,
+    index: Optional[FontIndex] = None,
+) -> List[zipfile.ZipInfo]:
+    """Return members of the archive of `handles` to be installed into `fontdir`.
+
+    If `index` is given, skip fonts as `select_fonts` does. Of fonts with the
+    same file name, only one is installed (see `unique_names`).
+    """
+    members = [
+        info
+        for info in handles.get().infolist()
+        if not info.is_dir() and is_font(info.filename)
+    ]
+
+    def meta(info: zipfile.ZipInfo) -> Optional[FontMeta]:
+        # Members are identified by the CRC instead of the modification time.
+        id = f"{handles.zip}:{info.filename}"
+        sig = [info.file_size, info.CRC]
+        return index.lookup(id, sig, lambda: handles.get().open(info))
+
+    if index is not None:
+        metas = map_in_parallel(members, meta, opt)
+        installed = installed_fonts(fontdir, index, opt)
+        names = [os.path.basename(info.filename) for info in members]
+        members = select_fonts(members, names, metas, installed)
+    names = [os.path.basename(info.filename) for info in members]
+    return unique_names(members, names)
 
 
-def win_install_fonts(fonts: List[Path], opt: Options) -> None:
-    """Install every font in `fonts` on Windows."""
-    if opt.dry:
-        return
-    fontdir = Path.home().joinpath("Downloads/fonts_extracted")
-    fontdir.mkdir(exist_ok=True)
-    for font in fonts:
-        font_dst = fontdir.joinpath(font.name)
-        copy_font(font, font_dst)
+class ZipHandles:
+    """Handles of zip archive `zip`, one for each thread using it."""
+
+    def __init__(self, zip: Path) -> None:
+        self.zip = zip
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.handles: List[zipfile.ZipFile] = []
+
+    def get(self) -> zipfile.ZipFile:
+        """Return the handle of the current thread, opening it if needed."""
+        if not hasattr(self.local, "zf"):
+            self.local.zf = zipfile.ZipFile(self.zip)
+            with self.lock:
+                self.handles.append(self.local.zf)
+        return self.local.zf
+
+    def close(self) -> None:
+        """Close every handle."""
+        with self.lock:
+            for handle in self.handles:
+                handle.close()
+            self.handles.clear()
+
+
+def unique_names(fonts: List, names: List[str]) -> List:
+    """Return fonts of `fonts` whose file names `names` are distinct.
+
+    Fonts are installed by their file names, so fonts with the same name (from
+    different directories) would overwrite each other, or even race with each
+    other in parallel. Of those, only the last is kept, which is what installing
+    them one by one would leave.
+    """
+    last: Dict[str, int] = {}
+    for i, name in enumerate(names):
+        last[os.path.normcase(name)] = i
+    unique = []
+    for i, (font, name) in enumerate(zip(fonts, names)):
+        if last[os.path.normcase(name)] != i:
+            logging.debug("Skipping font %s of the same name", emph_path(name))
+            count("fonts_skipped")
+            continue
+        unique.append(font)
+    return unique
+
+
+def file_meta(index: FontIndex, path: Path) -> Optional[FontMeta]:
+    """Return the metadata of font file `path` through `index`."""
+    st = os.stat(path)
+
+    def open_font() -> IO[bytes]:
+        return open(path, "rb")
+
+    return index.lookup(str(path), [st.st_size, st.st_mtime_ns], open_font)
+
+
+def installed_fonts(
+    fontdir: Path, index: FontIndex, opt: Options
+) -> Dict[str, Tuple[Tuple[int, ...], str]]:
+    """Return fonts installed in `fontdir`, by the keys of their metadata.
+
+    Each key is mapped to the newest version installed and its file name.
+    """
+    if not fontdir.is_dir():
+        return {}
+    fonts = [
+        Path(entry.path)
+        for _, entry in walk(fontdir)
+        if is_font(entry.name) and entry.is_file()
+    ]
+    metas = map_in_parallel(fonts, lambda font: file_meta(index, font), opt)
+    installed: Dict[str, Tuple[Tuple[int, ...], str]] = {}
+    for font, meta in zip(fonts, metas):
+        if not has_faces(meta):
+            continue
+        key = meta.key()
+        version = meta.version_key()
+        if key not in installed or installed[key][0] < version:
+            installed[key] = (version, font.name)
+    return installed
+
+
+def has_faces(meta: Optional[FontMeta]) -> bool:
+    """Return `True` if `meta` names the families of its fonts."""
+    return meta is not None and all(family for family, _ in meta.faces)
+
+
+def select_fonts(
+    fonts: List,
+    names: List[str],
+    metas: List[Optional[FontMeta]],
+    installed: Dict[str, Tuple[Tuple[int, ...], str]],
+) -> List:
+    """Return fonts of `fonts` worth installing.
+
+    `names` and `metas` are the file names and metadata of `fonts`, and
+    `installed` is what `installed_fonts` returns. Of fonts providing the same
+    faces, only the newest version is kept, and it is skipped if another file
+    provides them in the same or a newer version in the font directory. Fonts
+    whose metadata is unknown are always kept.
+    """
+    # Find the newest version of each key.
+    newest: Dict[str, int] = {}
+    for i, meta in enumerate(metas):
+        if not has_faces(meta):
+            continue
+        key = meta.key()
+        j = newest.get(key)
+        if j is None or metas[j].version_key() < meta.version_key():
+            newest[key] = i
+
+    selected = []
+    for i, (font, name, meta) in enumerate(zip(fonts, names, metas)):
+        if has_faces(meta):
+            key = meta.key()
+            other = installed.get(key)
+            if newest[key] != i:
+                logging.debug("Skipping duplicated font %s", emph_path(name))
+                count("fonts_skipped")
+                continue
+            if other is not None and other[1] != name:
+                if other[0] >= meta.version_key():
+                    logging.debug(
+                        "Skipping font %s, already installed as %s",
+                        emph_path(name),
+                        emph_path(other[1]),
+                    )
+                    count("fonts_skipped")
+                    continue
+        selected.append(font)
+    return selected
+
+
+def install_in_parallel(
+    fonts: List, install: Callable[..., bool], opt: Options
+) -> int:
+    """Call `install` on every font in `fonts` with `opt.jobs` workers.
+
+    `install` returns whether the font was installed or updated. Return the
+    number of such fonts.
+    """
+    return sum(map_in_parallel(fonts, install, opt))
+
+
+def map_in_parallel(items: List, fn: Callable, opt: Options) -> List:
+    """Return results of `fn` on every item in `items`, with `opt.jobs` workers."""
+    job = current_job()
+
+    def work(item):
+        # Count what the workers do for the current job.
+        set_current_job(job)
+        return fn(item)
+
+    with ThreadPoolExecutor(max_workers=max(1, opt.jobs)) as pool:
+        return list(pool.map(work, items))
+
+
+def copy_font(font: Path, font_dst: Path, opt: Options) -> bool:
+    """Copy `font` to `dst`, returning whether it is copied.
+
+    If `dst` is already identical, don't copy at all, since copying a font may
+    be heavy work. In a dry run, only record the change.
+    """
+    return copy_file(font, font_dst, opt.dry, opt.copy_strategy)
+
+
+def extract_font(
+    zf: zipfile.ZipFile, info: zipfile.ZipInfo, font_dst: Path, dry: bool = False
+) -> bool:
+    """Extract font `info` of `zf` as `font_dst`, returning whether it is extracted.
+
+    If `dst` is already identical, don't extract at all. The extracted font has
+    the modification time of the member, so that a later check needs no CRC.
+    If `dry`, only record the change.
+    """
+    count("files_checked")
+    mtime = time.mktime(info.date_time + (0, 0, -1))
+    if is_same_member(info, font_dst, mtime, sync=not dry):
+        if dry:
+            record_change("skip", "copy", str(font_dst))
+        return False
+    if dry:
+        action = "replace" if os.path.lexists(font_dst) else "create"
+        record_change(action, "copy", str(font_dst), info.file_size)
+        return True
+    tmp_dst = tmp_path(font_dst)
+    with zf.open(info) as fsrc, open(tmp_dst, "wb") as fdst:
+        shutil.copyfileobj(fsrc, fdst, BLOCK_SIZE)
+    os.utime(tmp_dst, (mtime, mtime))
+    get_journal().replace(tmp_dst, font_dst)
+    count("files_written")
+    count("bytes_copied", info.file_size)
+    return True
 
 
-def copy_font(font: Path, font_dst: Path) -> None:
-    """Copy `font` to `dst`.
+def is_same_member(
+    info: zipfile.ZipInfo, path: Path, mtime: float, sync: bool = True
+) -> bool:
+    """Return `True` if file `path` has the content of member `info`.
 
-    If `dst` already exists, don't copy at all, since copying a font may be
-    heavy work.
+    Compare the size first, then the modification time `mtime` of the member,
+    and then the CRC. If only the modification times differ and `sync`, set
+    that of `path` to `mtime`, so that the CRC is not needed next time.
     """
-    if not font_dst.is_file():
-        shutil.copy2(font,  font_dst)
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    if st.st_size != info.file_size:
+        return False
+    if int(st.st_mtime) == int(mtime):
+        return True
+    crc = 0
+    with open(path, "rb") as f:
+        while block := f.read(BLOCK_SIZE):
+            crc = zlib.crc32(block, crc)
+    if crc != info.CRC:
+        return False
+    if sync:
+        os.utime(path, (mtime, mtime))
+    return True
@@ -3,32 +3,134 @@
 A job defines an atomic operation of dotfiles installtion.
 """
 
-from dataclasses import dataclass
+from dataclasses import dataclass, field
+import itertools
 import logging
-from typing import Callable
+import os
+import threading
+import time
+from threading import Lock
+from typing import Callable, ContextManager, Dict, List, Optional
 
-from installer.style import print_done, print_failed
+from installer.console import get_console
 
+# Token of the current process, so that job IDs are unique across runs.
+_run_token = os.urandom(4).hex()
+_job_numbers = itertools.count(1)
 
-@dataclass
+
+def new_job_id() -> str:
+    """Return a new ID unique to a job."""
+    return f"{_run_token}-{next(_job_numbers)}"
+
+
+@dataclass(eq=False)
 class Job:
     """An atomic operation of dotfiles installation.
 
     `msg` is printed when the job begins, and `action` is a function that
-    describes what the job actually does (defaults to the `do` method).
+    describes what the job actually does (defaults to the `do` method). If
+    `action` returns a string, it is printed as a note when the job is done.
+    The job is only run after all jobs in `deps` have succeeded.
+
+    While running, the job is the current job of its thread (see
+    `current_job`), and records its timing and counters of what it has done.
+    Its action runs in the context of the hook set by `set_run_hook`, if any.
     """
     # The message to show.
     msg: str
     # The action to do.
-    action: Callable[[], None]
+    action: Callable[[], Optional[str]]
+    # Jobs that must succeed before this one.
+    deps: List["Job"] = field(default_factory=list)
+    # Whether the job succeeded, or `None` if it has not been run.
+    ok: Optional[bool] = None
+    # When the job started and ended, as returned by `time.time`.
+    start: Optional[float] = None
+    end: Optional[float] = None
+    # CPU time of the thread running the job, in seconds.
+    cpu: Optional[float] = None
+    # Counters of what the job has done, updated via `count`.
+    counters: Dict[str, int] = field(default_factory=dict)
+    counters_lock: Lock = field(default_factory=Lock, repr=False)
+    # The ID of the job, unlike its message unique among all jobs.
+    id: str = field(default_factory=new_job_id, init=False)
+
+    def run(self) -> bool:
+        """Run the job, returning whether it succeeded.
 
-    def run(self) -> None:
-        # No newline printed, we have to manually flush.
-        print(self.msg, end="...", flush=True)
+        The job may run concurrently with others, so its progress is shown via
+        the console, which keeps lines of different jobs apart.
+        """
+        console = get_console()
+        console.job_started(self)
+        error = None
+        note = None
+        set_current_job(self)
+        self.start = time.time()
+        cpu_start = time.thread_time()
         try:
-            self.action()
+            if _run_hook is None:
+                note = self.action()
+            else:
+                with _run_hook(self):
+                    note = self.action()
         except Exception as e:
-            print_failed()
-            logging.error(e)
-        else:
-            print_done()
+            error = e
+        finally:
+            self.cpu = time.thread_time() - cpu_start
+            self.end = time.time()
+            set_current_job(None)
+        self.ok = error is None
+        console.job_finished(self, note)
+        if error is not None:
+            logging.error(error)
+        return self.ok
+
+    def count(self, name: str, n: int = 1) -> None:
+        """Add `n` to the counter `name`."""
+        with self.counters_lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+
+# What every job runs its action in the context of, if anything.
+_run_hook: Optional[Callable[[Job], ContextManager[None]]] = None
+
+
+def set_run_hook(hook: Optional[Callable[[Job], ContextManager[None]]]) -> None:
+    """Make every job run its action in the context returned by `hook`.
+
+    This lets optional features like profiling wrap jobs, without `Job.run`
+    importing them.
+    """
+    global _run_hook
+    _run_hook = hook
+
+
+# The job each thread is running.
+_local = threading.local()
+
+
+def current_job() -> Optional[Job]:
+    """Return the job the current thread is running, if any."""
+    return getattr(_local, "job", None)
+
+
+def set_current_job(job: Optional[Job]) -> None:
+    """Make `job` the job of the current thread.
+
+    This lets helper threads of a job count what they do for the job.
+    """
+    _local.job = job
+
+
+def count(name: str, n: int = 1) -> None:
+    """Add `n` to the counter `name` of the current job, if any.
+
+    Counters in use are "files_checked", "files_written", "bytes_copied",
+    "commands", "fonts_skipped", and those of copies by each strategy (see
+    `file.COPY_COUNTERS`).
+    """
+    job = current_job()
+    if job is not None:
+        job.count(name, n)
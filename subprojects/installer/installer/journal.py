@@ -0,0 +1,170 @@
+"""Journal of destinations replaced during a run.
+
+Every file or link is written under a temporary name first, and then moved
+into place with `os.replace`, so a destination is never half-written. Before
+the move, the old destination is backed up and the move is appended to the
+journal, keyed on the ID of the job, so that the writes of a failed job can be
+undone. A directory of links replaced by a link to a whole directory is moved
+away whole as its backup.
+
+The journal is removed at the end of a run. If a run is interrupted, the next
+run finds the journal: it either rolls the interrupted run back (with
+"--rollback"), or resumes it by keeping what has already been done.
+"""
+
+import json
+import logging
+import os
+import shutil
+import uuid
+from pathlib import Path
+from threading import Lock
+from typing import List, Optional, Union
+
+from installer.cache import cache_dir
+from installer.job import current_job
+from installer.style import emph_path
+
+
+def tmp_path(dst: Path) -> Path:
+    """Return a temporary path to write `dst` to, removing anything there."""
+    tmp = dst.with_name(dst.name + ".installer-tmp")
+    if os.path.lexists(tmp):
+        os.unlink(tmp)
+    return tmp
+
+
+def is_file_or_link(path: Union[str, Path]) -> bool:
+    """Return `True` if `path` is a file or a link, but not a real directory."""
+    return os.path.islink(path) or os.path.isfile(path)
+
+
+class Journal:
+    """Journal stored in directory `dir`."""
+
+    def __init__(self, dir: Path) -> None:
+        self.path = dir.joinpath("journal.jsonl")
+        self.backup_dir = dir.joinpath("backups")
+        self.lock = Lock()
+        self.entries: List[dict] = []
+        try:
+            with open(self.path, "r") as f:
+                self.entries = [json.loads(line) for line in f if line.strip()]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.warning("Ignoring broken journal %s: %s", emph_path(self.path), e)
+
+    def interrupted(self) -> bool:
+        """Return `True` if the journal is left by an interrupted run."""
+        return len(self.entries) > 0
+
+    def replace(self, tmp: Path, dst: Path, replace_dir: bool = False) -> None:
+        """Move `tmp` to `dst` atomically, journaling the move.
+
+        If `dst` is a directory, it is moved away first if `replace_dir`, which
+        the caller must only ask for if the directory holds nothing of value.
+        Otherwise an exception is raised, leaving the directory alone.
+        """
+        job = current_job()
+        with self.lock:
+            backup = None
+            is_dir = False
+            if is_file_or_link(dst):
+                os.makedirs(self.backup_dir, exist_ok=True)
+                backup = self.backup_dir.joinpath(uuid.uuid4().hex)
+                back_up(dst, backup)
+            elif os.path.isdir(dst):
+                if not replace_dir:
+                    os.unlink(tmp)
+                    raise Exception(f"{emph_path(dst)} is a directory")
+                os.makedirs(self.backup_dir, exist_ok=True)
+                backup = self.backup_dir.joinpath(uuid.uuid4().hex)
+                shutil.move(str(dst), str(backup))
+                is_dir = True
+            entry = {
+                "job": job.id if job else "",
+                "dst": str(dst),
+                "backup": str(backup) if backup else None,
+                "dir": is_dir,
+            }
+            self.entries.append(entry)
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry) + "\n")
+        os.replace(tmp, dst)
+
+    def rollback(self, job_id: Optional[str] = None) -> int:
+        """Undo the moves of the job with ID `job_id`, or of all jobs.
+
+        Return the number of moves undone.
+        """
+        with self.lock:
+            undone = [
+                entry
+                for entry in self.entries
+                if job_id is None or entry["job"] == job_id
+            ]
+            if not undone:
+                return 0
+            for entry in reversed(undone):
+                dst = entry["dst"]
+                if entry.get("dir"):
+                    # Move the directory back in place of what replaced it.
+                    if is_file_or_link(dst):
+                        os.unlink(dst)
+                    shutil.move(entry["backup"], dst)
+                elif entry["backup"] is not None:
+                    os.replace(entry["backup"], dst)
+                elif is_file_or_link(dst):
+                    os.unlink(dst)
+                self.entries.remove(entry)
+            self._rewrite()
+            return len(undone)
+
+    def commit(self) -> None:
+        """Keep every move, removing the journal and the backups."""
+        with self.lock:
+            self.entries = []
+            if self.path.exists():
+                self.path.unlink()
+            if self.backup_dir.exists():
+                shutil.rmtree(self.backup_dir)
+
+    def _rewrite(self) -> None:
+        with open(self.path, "w") as f:
+            for entry in self.entries:
+                f.write(json.dumps(entry) + "\n")
+
+
+def back_up(path: Path, backup: Path) -> None:
+    """Back up file or link `path` as `backup`, leaving `path` in place.
+
+    Hard link it if possible, which needs no copying.
+    """
+    try:
+        os.link(path, backup, follow_symlinks=False)
+    except (OSError, NotImplementedError):
+        if os.path.islink(path):
+            os.symlink(os.readlink(path), backup)
+        else:
+            shutil.copy2(path, backup)
+
+
+# The journal of the current run, loaded when first needed.
+_journal: Optional[Journal] = None
+_journal_lock = Lock()
+
+
+def get_journal() -> Journal:
+    """Return the journal of the current run."""
+    global _journal
+    with _journal_lock:
+        if _journal is None:
+            _journal = Journal(cache_dir("journal"))
+        return _journal
+
+
+def rollback_job(job_id: str) -> None:
+    """Undo the moves of the job with ID `job_id`, if any."""
+    if _journal is not None:
+        _journal.rollback(job_id)
@@ -5,12 +5,13 @@ from logging import warning
 from typing import Union
 from typing import Callable
 
+from installer.console import get_console
 from installer.path import to_path
 from installer.style import emph_cmd
 
 
 def man_cmd(pred: Union[Callable[[], bool], str], instr: str, cmd: str) -> None:
-    """Print `instr` to run `cmd` when `pred` is not satisfied.
+    """Show `instr` to run `cmd` when `pred` is not satisfied.
 
     If `pred` is a callable, it should return a boolean, otherwise it should be
     a path which is checked for existence.
@@ -25,5 +26,4 @@ def man_cmd(pred: Union[Callable[[], bool], str], instr: str, cmd: str) -> None:
             warning(e)
             pass
     if not pred_result:
-        print(instr)
-        print("  " + emph_cmd(cmd))
+        get_console().message(instr + "\n  " + emph_cmd(cmd))
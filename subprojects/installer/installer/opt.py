@@ -11,5 +11,13 @@ class Options:
     dry: bool = False
     # Whether to do a home-manager switch.
     switch: bool = False
+    # Whether to run commands even if their inputs are unchanged.
+    rerun: bool = False
     # Whether to install fonts.
     fonts: bool = False
+    # Maximum number of jobs to run at once.
+    jobs: int = 1
+    # Whether to link whole directories at once where possible.
+    dir_links: bool = False
+    # How to copy files, one of `file.COPY_STRATEGIES` or "auto".
+    copy_strategy: str = "auto"
@@ -1,18 +1,21 @@
 """Utility for path management."""
 
 import os
+import re
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional, Tuple, Union
+from typing import List, Optional, Tuple, Union
 
 from installer.style import emph_path
 
 
-def is_repo():
-    """Return `True` if the current directory is the dotfiles repository."""
-    readme = Path.cwd().joinpath("README.md")
-    if not readme.exists():
-        return False
+def is_repo(dir: Optional[Path] = None):
+    """Return `True` if `dir` is the dotfiles repository.
 
+    `dir` defaults to the current directory.
+    """
+    readme = (dir or Path.cwd()).joinpath("README.md")
     try:
         with open(readme, "r") as f:
             first_line = f.readline().strip()
@@ -24,9 +27,16 @@ def is_repo():
 def setup_directory():
     """Change directory to the dotfiles repository.
 
-    Identify the dotfiles repository with the first line of its README. Keep
-    going up one level until the current directory is the dotfiles repository.
+    Identify the dotfiles repository with the first line of its README. Try the
+    directory of the running script first, since "install.pyz" lives at the
+    root of the repository. Otherwise keep going up one level until the current
+    directory is the dotfiles repository.
     """
+    script_dir = Path(sys.argv[0]).resolve().parent
+    if is_repo(script_dir):
+        os.chdir(script_dir)
+        return
+
     while not is_repo():
         cwd = Path.cwd()
         if cwd == cwd.parent:
@@ -37,6 +47,24 @@ def setup_directory():
             os.chdir(cwd.parent)
 
 
+# Environment variables that "~" may expand to.
+HOME_VARS = ("HOME", "USERPROFILE", "HOMEDRIVE", "HOMEPATH")
+
+# Environment variables referenced as "$VAR", "${VAR}" or "%VAR%".
+VAR_RE = re.compile(r"\$(\w+)|\$\{(\w+)\}|%(\w+)%")
+
+
+def referenced_vars(s: str) -> List[str]:
+    """Return the names of environment variables that `s` expands with."""
+    names = []
+    if s.startswith("~"):
+        names += HOME_VARS
+    if "$" in s or "%" in s:
+        for match in VAR_RE.finditer(s):
+            names.append(next(g for g in match.groups() if g))
+    return names
+
+
 def to_path(s: Union[str, os.PathLike]) -> Path:
     """Convert `s` to a normalized path.
 
@@ -66,10 +94,19 @@ def ensure_path(p: Union[str, os.PathLike]) -> Path:
 def some_path(*paths: str) -> Optional[Path]:
     """Return the first path available.
 
-    The path is converted to a proper path object via `to_path`.
+    The path is converted to a proper path object via `to_path`. All paths are
+    checked at once, since checking some of them (like those on a Windows drive
+    under WSL) may be slow.
     """
-    for p in paths:
-        path = to_path(p)
-        if path.exists():
-            return path
-    return None
+    candidates = [to_path(p) for p in paths]
+    if len(candidates) <= 1:
+        return next((path for path in candidates if path.exists()), None)
+    pool = ThreadPoolExecutor(max_workers=len(candidates))
+    try:
+        for path, exists in zip(candidates, pool.map(os.path.exists, candidates)):
+            if exists:
+                return path
+        return None
+    finally:
+        # Don't wait for slower checks of paths with lower priority.
+        pool.shutdown(wait=False)
@@ -0,0 +1,173 @@
+"""Install plans compiled from the manifest.
+
+The manifest ("install.json" at the root of the dotfiles repository) lists the
+links, copies and commands of each system. Compiling it resolves every path
+once; the result is cached, keyed on the manifest content and the environment
+the paths depend on, so repeated runs load it without resolving anything.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from dataclasses import asdict, dataclass, field, replace
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from installer.cache import cache_dir
+from installer.cmd import run
+from installer.file import copy, link
+from installer.job import Job
+from installer.opt import Options
+from installer.os import IS_LINUX, IS_WINDOWS, IS_WSL
+from installer.path import HOME_VARS, referenced_vars, to_path
+from installer.sched import Scheduler
+from installer.style import emph_path
+
+# Bump this whenever the format of compiled plans changes.
+PLAN_VERSION = 3
+
+
+@dataclass
+class Entry:
+    """A compiled entry of an install plan.
+
+    `kind` is "link", "copy" or "run". For "run", `src` is the command and
+    `dst` is empty. `src_path` and `dst_path` are the resolved `src` and `dst`.
+    A command with `inputs` is skipped if they are unchanged since it last
+    succeeded (see `cmd.run`). A link without `dir_link` never links a whole
+    directory, even with `Options.dir_links`, which is for destinations that
+    programs write into.
+    """
+    kind: str
+    src: str
+    dst: str = ""
+    src_path: str = ""
+    dst_path: str = ""
+    # Name of this entry, for other entries to depend on.
+    id: str = ""
+    # Names of entries that must succeed before this one.
+    after: List[str] = field(default_factory=list)
+    # Name of an option that must be enabled for this entry to run.
+    cond: str = ""
+    # Resolved paths the command depends on, if known.
+    inputs: Optional[List[str]] = None
+    # Whether a directory may be linked as a whole.
+    dir_link: bool = True
+
+
+def system_key() -> str:
+    """Return the key of the current system in the manifest."""
+    if IS_LINUX:
+        return "linux"
+    elif IS_WINDOWS:
+        return "windows"
+    else:
+        raise OSError("Unsupported system.")
+
+
+def plan_key(manifest: bytes) -> str:
+    """Return the cache key of the plan compiled from `manifest`.
+
+    The key covers everything that path resolution depends on: the manifest,
+    the working directory, the system, and the referenced variables.
+    """
+    names = set(HOME_VARS)
+    names.update(referenced_vars(manifest.decode("utf-8")))
+    env = {name: os.environ.get(name) for name in sorted(names)}
+    data = {
+        "version": PLAN_VERSION,
+        "cwd": os.getcwd(),
+        "system": [IS_LINUX, IS_WINDOWS, IS_WSL],
+        "env": env,
+    }
+    hasher = hashlib.sha256(manifest)
+    hasher.update(json.dumps(data, sort_keys=True).encode("utf-8"))
+    return hasher.hexdigest()
+
+
+def compile_plan(manifest: bytes) -> List[Entry]:
+    """Compile `manifest` into entries of the current system."""
+    entries = []
+    for item in json.loads(manifest).get(system_key(), []):
+        if "run" in item:
+            entry = Entry("run", item["run"])
+            if "inputs" in item:
+                entry.inputs = [str(to_path(input)) for input in item["inputs"]]
+        else:
+            kind = "link" if "link" in item else "copy"
+            src, dst = item[kind], item["to"]
+            entry = Entry(kind, src, dst, str(to_path(src)), str(to_path(dst)))
+            entry.dir_link = item.get("dir_link", True)
+        entry.id = item.get("id", "")
+        entry.after = item.get("after", [])
+        entry.cond = item.get("if", "")
+        entries.append(entry)
+    return entries
+
+
+def load_plan(manifest_path: str, cache: bool = True) -> List[Entry]:
+    """Load the plan of `manifest_path`, compiling it if not cached.
+
+    If `cache` is `False`, a compiled plan is not cached.
+    """
+    manifest = to_path(manifest_path).read_bytes()
+    key = plan_key(manifest)
+    plan_path = cache_dir("plans").joinpath(f"{key}.json")
+
+    # Use the cached plan if possible.
+    try:
+        with open(plan_path, "r") as f:
+            return [Entry(**entry) for entry in json.load(f)]
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logging.debug("Ignoring broken plan %s: %s", emph_path(plan_path), e)
+
+    # Otherwise compile and cache it.
+    entries = compile_plan(manifest)
+    if not cache:
+        return entries
+    tmp_path = plan_path.with_suffix(".tmp")
+    with open(tmp_path, "w") as f:
+        json.dump([asdict(entry) for entry in entries], f)
+    os.replace(tmp_path, plan_path)
+    return entries
+
+
+def entry_job(entry: Entry, opt: Options) -> Job:
+    """Return the job of `entry`."""
+    if entry.kind == "run":
+        return run(entry.src, opt, inputs=entry.inputs)
+    resolved = (Path(entry.src_path), Path(entry.dst_path))
+    if entry.kind == "link":
+        if not entry.dir_link:
+            opt = replace(opt, dir_links=False)
+        return link(entry.src, entry.dst, opt, resolved)
+    else:
+        return copy(entry.src, entry.dst, opt, resolved)
+
+
+def schedule_plan(
+    sched: Scheduler, entries: List[Entry], opt: Options
+) -> Dict[str, Job]:
+    """Add jobs of enabled `entries` to `sched`.
+
+    Return the jobs of entries with an ID, by their ID. Raise an exception if an
+    entry is after an ID of no entry.
+    """
+    ids = {entry.id for entry in entries if entry.id}
+    for entry in entries:
+        for id in entry.after:
+            if id not in ids:
+                name = entry.id or entry.src
+                raise Exception(f"Entry {emph_path(name)} is after unknown ID {id!r}")
+    jobs: Dict[str, Job] = {}
+    for entry in entries:
+        if entry.cond and not getattr(opt, entry.cond):
+            continue
+        job = entry_job(entry, opt)
+        sched.add(job, after=[jobs[id] for id in entry.after if id in jobs])
+        if entry.id:
+            jobs[entry.id] = job
+    return jobs
@@ -0,0 +1,163 @@
+"""Profiling of jobs, for finding where a slow run spends its time.
+
+When a profiler is set up, it hooks into `Job.run`, and every job matching its
+pattern runs under cProfile, and optionally tracemalloc. The statistics of each
+job are written to a ".pstats" file (and a ".tracemalloc" snapshot), which can
+be inspected with `pstats` or other tools later. A report of the functions
+taking the most time across all profiled jobs is shown at the end of the run.
+
+Both profilers trace the whole process (cProfile does since Python 3.12), so
+profiled jobs run one at a time. Calls of other jobs running meanwhile may be
+counted too, so profile with a single worker for exact numbers.
+"""
+
+import cProfile
+import fnmatch
+import os
+import pstats
+import re
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from threading import Lock
+from typing import TYPE_CHECKING, Iterator, List, Optional, Tuple
+
+from installer.console import get_console
+from installer.diff import format_size
+from installer.job import set_run_hook
+from installer.style import emph, emph_path, plain
+
+if TYPE_CHECKING:
+    from installer.job import Job
+
+# Number of functions shown in the report.
+TOP = 20
+
+
+class Profiler:
+    """Profiler of jobs matching `pattern`, writing statistics to `dir`.
+
+    `pattern` is a shell-style pattern matched against job messages, matching
+    every job if `None`. If `memory`, allocations are traced too.
+    """
+
+    def __init__(self, dir: Path, pattern: Optional[str], memory: bool) -> None:
+        self.dir = dir
+        self.pattern = pattern
+        self.memory = memory
+        self.lock = Lock()
+        # Messages of profiled jobs, with their statistics files.
+        self.paths: List[Tuple[str, Path]] = []
+        # Messages of profiled jobs, with their peak traced memory.
+        self.peaks: List[Tuple[str, int]] = []
+
+    def matches(self, job: "Job") -> bool:
+        """Return `True` if `job` should be profiled."""
+        return self.pattern is None or fnmatch.fnmatch(plain(job.msg), self.pattern)
+
+    @contextmanager
+    def profile(self, job: "Job") -> Iterator[None]:
+        """Profile `job` in the context."""
+        with self.lock:
+            profile = cProfile.Profile()
+            if self.memory:
+                tracemalloc.start()
+            profile.enable()
+            try:
+                yield
+            finally:
+                profile.disable()
+                self.save(job, profile)
+
+    def save(self, job: "Job", profile: cProfile.Profile) -> None:
+        """Save the statistics of `job` in `profile`, and those of tracemalloc."""
+        msg = plain(job.msg)
+        name = re.sub(r"[^\w.-]+", "_", msg).strip("_")[:60]
+        path = self.dir.joinpath(f"{len(self.paths) + 1:03d}-{name}.pstats")
+        os.makedirs(self.dir, exist_ok=True)
+        profile.dump_stats(str(path))
+        self.paths.append((msg, path))
+        if self.memory:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.peaks.append((msg, peak))
+            snapshot.dump(str(path.with_suffix(".tracemalloc")))
+
+    def report(self) -> None:
+        """Show where profiled jobs spent the most time, and their peak memory."""
+        if not self.paths:
+            get_console().message("No job is profiled.")
+            return
+        stats = pstats.Stats(*(str(path) for _, path in self.paths))
+        # Each entry is (primitive calls, calls, own time, cumulative time, _).
+        entries = sorted(
+            stats.stats.items(),  # type: ignore[attr-defined]
+            key=lambda item: item[1][3],
+            reverse=True,
+        )[:TOP]
+        top = [
+            {
+                "function": func,
+                "file": file,
+                "line": line,
+                "calls": calls,
+                "own": own,
+                "cumulative": cumulative,
+            }
+            for (file, line, func), (_, calls, own, cumulative, _) in entries
+        ]
+        lines = [
+            "Profiled {} jobs into {}.".format(len(self.paths), emph_path(self.dir)),
+            "{:>10} {:>10} {:>10}  {}".format("calls", "own", "cumulative", "function"),
+        ]
+        for entry in top:
+            where = entry["function"]
+            if entry["file"] != "~":
+                where = f"{where} ({os.path.basename(entry['file'])}:{entry['line']})"
+            lines.append(
+                "{:>10} {:>9.3f}s {:>9.3f}s  {}".format(
+                    entry["calls"], entry["own"], entry["cumulative"], where
+                )
+            )
+        for msg, peak in self.peaks:
+            lines.append("Peak memory of {}: {}".format(msg, emph(format_size(peak))))
+        get_console().event(
+            {
+                "event": "profile",
+                "dir": str(self.dir),
+                "jobs": [{"job": msg, "file": str(path)} for msg, path in self.paths],
+                "top": top,
+                "peaks": [{"job": msg, "bytes": peak} for msg, peak in self.peaks],
+            },
+            "\n".join(lines),
+        )
+
+
+# The profiler of the current run, if profiling.
+_profiler: Optional[Profiler] = None
+
+
+def get_profiler() -> Optional[Profiler]:
+    """Return the profiler of the current run, if profiling."""
+    return _profiler
+
+
+def setup_profiler(
+    dir: Path, pattern: Optional[str] = None, memory: bool = False
+) -> Profiler:
+    """Profile jobs of the current run, see `Profiler`."""
+    global _profiler
+    _profiler = Profiler(dir, pattern, memory)
+    set_run_hook(profiling)
+    return _profiler
+
+
+@contextmanager
+def profiling(job: "Job") -> Iterator[None]:
+    """Profile `job` in the context if it should be."""
+    if _profiler is None or not _profiler.matches(job):
+        yield
+    else:
+        with _profiler.profile(job):
+            yield
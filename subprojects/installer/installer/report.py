@@ -0,0 +1,53 @@
+"""Machine-readable reports of installer runs.
+
+A report is a JSON Lines file: one object per job, followed by one summarizing
+the whole run, so that reports of many runs can simply be concatenated.
+"""
+
+import json
+import socket
+from typing import Dict, List
+
+from installer.job import Job
+from installer.style import plain
+
+
+def job_record(job: Job) -> dict:
+    """Return the report record of `job`."""
+    ran = job.start is not None and job.end is not None
+    return {
+        "job": plain(job.msg),
+        "ok": bool(job.ok),
+        "skipped": not ran,
+        "start": job.start,
+        "end": job.end,
+        "wall": job.end - job.start if ran else None,
+        "cpu": job.cpu,
+        "counters": dict(job.counters),
+    }
+
+
+def total_counters(jobs: List[Job]) -> Dict[str, int]:
+    """Return the sum of every counter of `jobs`."""
+    totals: Dict[str, int] = {}
+    for job in jobs:
+        for name, n in job.counters.items():
+            totals[name] = totals.get(name, 0) + n
+    return totals
+
+
+def write_report(path: str, jobs: List[Job], start: float, end: float) -> None:
+    """Write the report of a run of `jobs` from `start` to `end` to `path`."""
+    summary = {
+        "host": socket.gethostname(),
+        "start": start,
+        "end": end,
+        "wall": end - start,
+        "jobs": len(jobs),
+        "failed": sum(not job.ok for job in jobs),
+        "counters": total_counters(jobs),
+    }
+    with open(path, "w") as f:
+        for job in jobs:
+            f.write(json.dumps(job_record(job)) + "\n")
+        f.write(json.dumps(summary) + "\n")
@@ -1,30 +1,449 @@
-"""Utility for Rime configuration."""
+"""Utility for Rime configuration.
 
+Deploying Rime compiles the dictionaries of every schema, which takes long
+with large dictionaries. The deploy job only rebuilds the schemas affected by
+changes since the last deploy: each schema is keyed by the hashes of its file,
+its custom file, and the dictionaries it uses (including those imported by
+them), and is rebuilt only if the key has changed or its artifacts are gone.
 
+Only the few keys needed are read from the YAML files, without a YAML parser,
+and only in the block style Rime data is documented with. A schema whose files
+cannot be read that way (like ones using "__include" or "__patch") is always
+rebuilt. For dictionaries, only the header before the "..." line is read.
+"""
+
+import glob
+import hashlib
+import logging
+import os
+import re
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from installer.cache import Store, cache_dir
+from installer.cmd import Runner, ensure_exe, run_cmd
+from installer.file import copy_path, file_digest, write_file
 from installer.job import Job
 from installer.opt import Options
-from installer.path import to_path
+from installer.os import IS_WINDOWS
+from installer.path import some_path, to_path
+from installer.state import stat_key
+from installer.style import emph_path
+
+# A function rebuilding `schemas` of user data directory `src` into build
+# directory `build`, via a runner.
+Deployer = Callable[[List[Path], Path, Path, Options, Runner], None]
+
+# Possible user data directories of Rime frontends on Linux, where built
+# artifacts are installed if they exist.
+LINUX_USER_DIRS = (
+    "~/.local/share/fcitx5/rime",
+    "~/.config/ibus/rime",
+    "~/.emacs.d/rime",
+)
+
+# Possible shared data directories of Rime on Linux.
+LINUX_SHARED_DIRS = (
+    "~/.nix-profile/share/rime-data",
+    "/usr/share/rime-data",
+    "/usr/share/rime",
+)
 
 
-def win_rime_setup(opt: Options) -> None:
-    """Do extra setup for Rime on Windows, handling errors."""
+def win_rime_setup(opt: Options) -> Job:
+    """Return a job doing extra setup for Rime on Windows, handling errors."""
     msg = "Configuring the Cangjie6 schema"
 
     def action() -> None:
         win_configure_cangjie6(opt)
 
-    Job(msg, action).run()
+    return Job(msg, action)
 
 
 def win_configure_cangjie6(opt: Options) -> None:
-    """Write the additional configuration file for the Cangjie6 schema."""
-    if opt.dry:
-        return
+    """Write the additional configuration file for the Cangjie6 schema.
 
+    In a dry run, only record the change.
+    """
     path = to_path("%appdata%/rime/cangjie6.custom.yaml")
     content = """
 patch:
   "switches/@2/reset": 1
     """
-    with open(path, "w") as fp:
-        fp.write(content)
+    write_file(path, content, opt.dry)
+
+
+def rime_deploy(
+    src: str,
+    opt: Options,
+    runner: Runner = run_cmd,
+    deployer: Optional[Deployer] = None,
+) -> Job:
+    """Return a job deploying Rime user data directory `src`, handling errors.
+
+    Affected schemas are rebuilt by `deployer` (defaults to `default_deployer`),
+    which runs commands via `runner`.
+    """
+    msg = f"Deploying Rime schemas in {emph_path(src)}"
+
+    def action() -> str:
+        src_path = to_path(src)
+        build = rime_build_dir(src_path)
+        store = Store("rime.json")
+        keys = schema_keys(src_path, store)
+        built = store.get("schemas", {})
+        affected = [
+            schema
+            for schema, key in keys.items()
+            if key is None
+            or built.get(str(schema)) != key
+            or not has_artifacts(schema, build)
+        ]
+        if not affected:
+            return "nothing changed"
+        # In a dry run, the deployer only records the commands to run.
+        (deployer or default_deployer())(affected, src_path, build, opt, runner)
+        if opt.dry:
+            return f"{len(affected)} schemas to rebuild"
+        for schema in affected:
+            built[str(schema)] = keys[schema]
+        store.set("schemas", built)
+        if not IS_WINDOWS:
+            install_artifacts(build, opt)
+        return f"{len(affected)} schemas rebuilt"
+
+    return Job(msg, action)
+
+
+def rime_build_dir(src: Path) -> Path:
+    """Return the directory to build schemas of `src` into.
+
+    On Windows, it is where Weasel looks for them. Elsewhere, it is kept in the
+    cache, and its artifacts are installed for every frontend found.
+    """
+    if IS_WINDOWS:
+        return src.joinpath("build")
+    return cache_dir("rime", "build")
+
+
+# A line of YAML in block style: a list item, a key (possibly quoted) with its
+# value, or a value alone.
+YAML_LINE_RE = re.compile(
+    r"""\s*(?:(-)\s+|("[^"]*"|'[^']*'|[^\s"'#:-][^:]*?):(?:\s+|$))?(.*)$"""
+)
+
+
+def read_yaml(path: Path, header_only: bool = False) -> List[Tuple[int, str, str]]:
+    """Return the indentation, key and value of each line of YAML file `path`.
+
+    Only the block style used by Rime data is understood. A list item has the
+    key "-", and the rest of its line as the value. A value may be on the line
+    after its key. Block scalars ("|" or ">") are skipped. Raise `ValueError` on
+    anything else, and on directives like "__include" and "__patch", which pull
+    in data from elsewhere.
+
+    If `header_only`, stop at the "..." line that ends a dictionary header, or
+    at once if the file does not start with a header.
+    """
+    entries: List[Tuple[int, str, str]] = []
+    block_indent = None
+    with open(path, "r", encoding="utf-8-sig") as f:
+        for line in f:
+            if header_only and line.rstrip() == "...":
+                break
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            indent = len(line) - len(line.lstrip())
+            if block_indent is not None and indent > block_indent:
+                continue
+            block_indent = None
+            if line.rstrip() == "---":
+                continue
+            match = YAML_LINE_RE.match(line.split(" #", 1)[0].rstrip())
+            assert match is not None
+            item, key, value = match.groups()
+            if item is not None:
+                key = "-"
+            if header_only and not entries and key is None:
+                # Not a dictionary header.
+                break
+            if (
+                key is None
+                and entries
+                and indent > entries[-1][0]
+                and re.fullmatch(r"(&\S+)?", entries[-1][2])
+            ):
+                # The value of the last key (after its anchor if any).
+                last_indent, last_key, last_value = entries[-1]
+                entries[-1] = (last_indent, last_key, f"{last_value} {value}".strip())
+                continue
+            if key is None:
+                raise ValueError(f"cannot parse {line.strip()!r}")
+            key = key.strip("\"'")
+            if key.startswith("__") or "/__" in key:
+                raise ValueError(f"unsupported directive {key!r}")
+            if value.startswith(("|", ">")):
+                block_indent = indent
+            entries.append((indent, key, value))
+    return entries
+
+
+def yaml_scalar(value: str, anchors: Optional[Dict[str, str]] = None) -> str:
+    """Return plain scalar `value`, which may be anchored or quoted.
+
+    An alias is resolved via scalars by their anchors in `anchors`. Raise
+    `ValueError` if the value is not a plain scalar, like a flow collection or
+    an alias of anything else.
+    """
+    if value.startswith("*") and anchors is not None and value[1:] in anchors:
+        return anchors[value[1:]]
+    if value.startswith("&"):
+        value = value.split(None, 1)[1] if " " in value else ""
+    if not value or value.startswith(("*", "[", "{", "|", ">", "!", "&")):
+        raise ValueError(f"unsupported value {value!r}")
+    return value.strip("\"'")
+
+
+def yaml_values(entries: List[Tuple[int, str, str]], key: str) -> List[str]:
+    """Return the scalar values of `key` anywhere in `entries` of `read_yaml`.
+
+    Keys of patches like "translator/dictionary" count as their last part.
+    Aliases of anchored scalars are resolved.
+    """
+    anchors = {}
+    for _, _, value in entries:
+        if value.startswith("{") and re.search(rf"\b{re.escape(key)}\s*:", value):
+            raise ValueError(f"{key} in a flow mapping")
+        match = re.fullmatch(r"&(\S+)\s+(.+)", value)
+        if match is not None:
+            anchors[match.group(1)] = yaml_scalar(match.group(2))
+    return [
+        yaml_scalar(value, anchors)
+        for _, entry_key, value in entries
+        if entry_key.rsplit("/", 1)[-1] == key
+    ]
+
+
+def yaml_list(entries: List[Tuple[int, str, str]], key: str) -> List[str]:
+    """Return the items of list `key` in `entries` of `read_yaml`, unparsed.
+
+    Items are taken from a block list, or a flow list of scalars.
+    """
+    items = []
+    for i, (indent, entry_key, value) in enumerate(entries):
+        if entry_key != key:
+            continue
+        if value.startswith("["):
+            if not value.endswith("]"):
+                raise ValueError(f"unsupported list {value!r}")
+            items += [item.strip() for item in value[1:-1].split(",")]
+            continue
+        if value:
+            raise ValueError(f"{key} is not a list")
+        for item_indent, item_key, item in entries[i + 1 :]:
+            if item_key != "-" or item_indent < indent:
+                break
+            items.append(item)
+    return items
+
+
+def schema_keys(src: Path, store: Store) -> Dict[Path, Optional[str]]:
+    """Return the key of every deployed schema in `src`.
+
+    The key covers the files of `schema_files` and the dictionaries they use.
+    It is `None` if any of them cannot be parsed, so that the schema is always
+    rebuilt. Digests of files are cached in `store` by their stats, so unchanged
+    files are not read again.
+    """
+    cached = store.get("digests", {})
+    digests = {}
+
+    def digest(path: Path) -> str:
+        if str(path) in digests:
+            return digests[str(path)]["digest"]
+        st = os.stat(path)
+        record = cached.get(str(path))
+        if record is None or record["stat"] != stat_key(st):
+            record = {"stat": stat_key(st), "digest": file_digest(path).hex()}
+        digests[str(path)] = record
+        return record["digest"]
+
+    # Find dictionaries imported by each dictionary, or `None` if unknown.
+    dict_paths = {
+        path.name[: -len(".dict.yaml")]: path for path in src.glob("*.dict.yaml")
+    }
+    imports: Dict[str, Optional[List[str]]] = {}
+    for name, path in dict_paths.items():
+        try:
+            header = read_yaml(path, header_only=True)
+            tables = yaml_list(header, "import_tables")
+            imports[name] = [yaml_scalar(table) for table in tables]
+        except ValueError as e:
+            logging.debug("Cannot parse %s: %s", emph_path(path), e)
+            imports[name] = None
+
+    keys: Dict[Path, Optional[str]] = {}
+    for schema in deployed_schemas(src):
+        try:
+            parts, names = schema_files(src, schema)
+            dicts = dict_closure(names, imports)
+        except ValueError as e:
+            logging.debug("Cannot parse %s: %s", emph_path(schema), e)
+            keys[schema] = None
+            continue
+        parts += [dict_paths[name] for name in sorted(dicts)]
+        h = hashlib.sha256()
+        for path in parts:
+            if path.exists():
+                h.update(f"{path.name}:{digest(path)}\n".encode())
+        keys[schema] = h.hexdigest()
+
+    store.set("digests", digests)
+    return keys
+
+
+def schema_files(src: Path, schema: Path) -> Tuple[List[Path], List[str]]:
+    """Return files in `src` that schema file `schema` is deployed from.
+
+    These are the schema, its custom file, and those of the schemas it depends
+    on (listed in "schema/dependencies", or whose prisms it uses), directly or
+    not. Also return the dictionaries they use. Raise `ValueError` if any of
+    them cannot be parsed.
+    """
+    files: List[Path] = []
+    names: List[str] = []
+    stack = [schema]
+    while stack:
+        path = stack.pop()
+        if path in files or not path.exists():
+            continue
+        entries = read_yaml(path)
+        schema_id = (yaml_values(entries, "schema_id") or [path.name])[0]
+        custom = src.joinpath(f"{schema_id}.custom.yaml")
+        names += yaml_values(entries, "dictionary")
+        deps = [yaml_scalar(dep) for dep in yaml_list(entries, "dependencies")]
+        deps += yaml_values(entries, "prism")
+        # A custom file may patch them too.
+        if custom.exists():
+            entries = read_yaml(custom)
+            names += yaml_values(entries, "dictionary")
+            deps += [
+                yaml_scalar(dep) for dep in yaml_list(entries, "schema/dependencies")
+            ]
+            deps += yaml_values(entries, "prism")
+        files += [path, custom]
+        stack += [src.joinpath(f"{dep}.schema.yaml") for dep in deps]
+    return files, names
+
+
+def deployed_schemas(src: Path) -> List[Path]:
+    """Return schema files in `src` listed in "default.custom.yaml".
+
+    If there is no such list, or it cannot be parsed, return every schema file.
+    """
+    schemas = sorted(src.glob("*.schema.yaml"))
+    custom = src.joinpath("default.custom.yaml")
+    if not custom.exists():
+        return schemas
+    try:
+        items = yaml_list(read_yaml(custom), "schema_list")
+    except ValueError as e:
+        logging.debug("Cannot parse %s: %s", emph_path(custom), e)
+        return schemas
+    listed = [
+        match.group(1)
+        for item in items
+        for match in [re.fullmatch(r"\{?\s*schema:\s*([\w.]+)\s*\}?", item)]
+        if match is not None
+    ]
+    if not listed:
+        return schemas
+    return [
+        schema for schema in schemas if schema.name[: -len(".schema.yaml")] in listed
+    ]
+
+
+def dict_closure(names: List[str], imports: Dict[str, Optional[List[str]]]) -> Set[str]:
+    """Return dictionaries `names` with those they import, directly or not.
+
+    Only dictionaries in `imports` are returned, since others are not part of
+    the user data. Raise `ValueError` if the imports of any of them are unknown.
+    """
+    found: Set[str] = set()
+    stack = list(names)
+    while stack:
+        name = stack.pop()
+        if name in found or name not in imports:
+            continue
+        tables = imports[name]
+        if tables is None:
+            raise ValueError(f"cannot parse dictionary {name}")
+        found.add(name)
+        stack.extend(tables)
+    return found
+
+
+def has_artifacts(schema: Path, build: Path) -> bool:
+    """Return `True` if built `schema` is in `build`."""
+    try:
+        schema_id = (yaml_values(read_yaml(schema), "schema_id") or [""])[0]
+    except ValueError:
+        return False
+    return build.joinpath(f"{schema_id}.schema.yaml").exists()
+
+
+def default_deployer() -> Deployer:
+    """Return the deployer of the current system."""
+    return weasel_deploy if IS_WINDOWS else rime_deployer_compile
+
+
+def rime_deployer_compile(
+    schemas: List[Path], src: Path, build: Path, opt: Options, runner: Runner = run_cmd
+) -> None:
+    """Compile `schemas` of `src` into `build` one by one with \"rime_deployer\"."""
+    ensure_exe("rime_deployer")
+    shared = some_path(*LINUX_SHARED_DIRS) or src
+    for schema in schemas:
+        cmd = f"rime_deployer --compile {schema} {src} {shared} {build}"
+        if runner(cmd, opt) != 0:
+            raise Exception(f"Error compiling {emph_path(schema)}")
+
+
+def weasel_deploy(
+    schemas: List[Path], src: Path, build: Path, opt: Options, runner: Runner = run_cmd
+) -> None:
+    """Deploy with Weasel, which rebuilds what has changed in `src`.
+
+    Weasel cannot build single schemas, so it is only run once for all
+    `schemas`.
+    """
+    deployer = ensure_weasel_deployer()
+    # Run it from its own directory, since its path likely contains spaces.
+    if runner("WeaselDeployer.exe /deploy", opt, cwd=deployer.parent, shell=True) != 0:
+        raise Exception("Error deploying Rime")
+
+
+@lru_cache(maxsize=None)
+def ensure_weasel_deployer() -> Path:
+    """Ensure and return the \"WeaselDeployer.exe\" program."""
+    for var in ("ProgramFiles", "ProgramFiles(x86)"):
+        base = os.environ.get(var)
+        if base is None:
+            continue
+        # Prefer the latest version installed.
+        for dir in sorted(
+            glob.glob(os.path.join(base, "Rime", "weasel-*")), reverse=True
+        ):
+            path = Path(dir).joinpath("WeaselDeployer.exe")
+            if path.exists():
+                return path
+    raise Exception("WeaselDeployer.exe not found")
+
+
+def install_artifacts(build: Path, opt: Options) -> None:
+    """Copy artifacts in `build` to the build directory of every frontend."""
+    for user_dir in LINUX_USER_DIRS:
+        user_path = to_path(user_dir)
+        if user_path.is_dir():
+            copy_path(build, user_path.joinpath("build"), opt)
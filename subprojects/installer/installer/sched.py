@@ -0,0 +1,67 @@
+"""Scheduling of jobs.
+
+Jobs form a dependency graph via `Job.deps`. The scheduler runs every job whose
+dependencies have succeeded, running independent jobs concurrently on a thread
+pool.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Dict, Iterable, List
+
+from installer.console import get_console
+from installer.job import Job
+from installer.journal import rollback_job
+
+
+class Scheduler:
+    """Collect jobs and run them with at most `jobs` workers."""
+
+    def __init__(self, jobs: int = 1) -> None:
+        self.jobs = max(1, jobs)
+        self.queue: List[Job] = []
+
+    def add(self, job: Job, after: Iterable[Job] = ()) -> Job:
+        """Add `job` to run after `after` (and its own deps), returning it."""
+        for dep in after:
+            if dep not in job.deps:
+                job.deps.append(dep)
+        for dep in job.deps:
+            if dep not in self.queue:
+                self.add(dep)
+        if job not in self.queue:
+            self.queue.append(job)
+        return job
+
+    def add_all(self, jobs: Iterable[Job], after: Iterable[Job] = ()) -> List[Job]:
+        """Add every job in `jobs` via `add`, returning them."""
+        after = list(after)
+        return [self.add(job, after) for job in jobs]
+
+    def run(self) -> None:
+        """Run all added jobs, in insertion order where possible.
+
+        A job is skipped if any of its dependencies failed or was skipped. What
+        a failed job has written is rolled back.
+        """
+        pending = list(self.queue)
+        running: Dict[Future, Job] = {}
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            while pending or running:
+                for job in list(pending):
+                    if any(dep.ok is False for dep in job.deps):
+                        # A dependency failed, so never run this.
+                        job.ok = False
+                        pending.remove(job)
+                        get_console().job_skipped(job)
+                    elif all(dep.ok for dep in job.deps):
+                        pending.remove(job)
+                        running[pool.submit(job.run)] = job
+                if not running:
+                    # Remaining jobs depend on jobs never added.
+                    raise Exception("Unsatisfiable job dependencies")
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = running.pop(future)
+                    if not future.result():
+                        # Undo what the failed job has done.
+                        rollback_job(job.id)
@@ -0,0 +1,161 @@
+"""Metadata of fonts, read from the "name" tables of SFNT files.
+
+TrueType and OpenType fonts (and their collections) are SFNT files, whose
+"name" table tells the family, style and version of each font. Only the headers
+and the "name" table are read, not the whole font.
+
+The index keeps the metadata of every font seen between runs, keyed on what
+cheaply identifies its content: the size and modification time of a file, or
+the size and CRC of a member of a zip archive. So each font is parsed once.
+"""
+
+import logging
+import re
+import struct
+from dataclasses import dataclass
+from typing import IO, Callable, Dict, List, Optional, Tuple
+
+from installer.cache import Store
+from installer.style import emph_path
+
+# IDs of names in the "name" table.
+NAME_FAMILY = 1
+NAME_STYLE = 2
+NAME_VERSION = 5
+NAME_TYPOGRAPHIC_FAMILY = 16
+NAME_TYPOGRAPHIC_STYLE = 17
+
+
+@dataclass
+class FontMeta:
+    """Metadata of a font file."""
+
+    # Family and style of every font in the file.
+    faces: List[Tuple[str, str]]
+    # Version of the first font in the file.
+    version: str
+
+    def key(self) -> str:
+        """Return what the file provides, which is the same for duplicates."""
+        faces = sorted(f"{family}/{style}" for family, style in self.faces)
+        return "|".join(faces).lower()
+
+    def version_key(self) -> Tuple[int, ...]:
+        """Return the version as numbers, for comparison."""
+        match = re.search(r"\d+(?:\.\d+)*", self.version)
+        return tuple(int(n) for n in match.group(0).split(".")) if match else ()
+
+
+def read_meta(f: IO[bytes]) -> FontMeta:
+    """Read the metadata of a font from seekable binary file `f`."""
+    tag = f.read(4)
+    if tag == b"ttcf":
+        # A collection, with offsets of its fonts after the header.
+        _, num_fonts = struct.unpack(">II", f.read(8))
+        offsets = struct.unpack(f">{num_fonts}I", f.read(4 * num_fonts))
+    else:
+        offsets = (0,)
+    faces = []
+    version = ""
+    for offset in offsets:
+        names = read_names(f, offset)
+        family = names.get(NAME_TYPOGRAPHIC_FAMILY) or names.get(NAME_FAMILY, "")
+        style = names.get(NAME_TYPOGRAPHIC_STYLE) or names.get(NAME_STYLE, "")
+        faces.append((family, style))
+        version = version or names.get(NAME_VERSION, "")
+    return FontMeta(faces, version)
+
+
+def read_names(f: IO[bytes], offset: int) -> Dict[int, str]:
+    """Read the "name" table of the font at `offset` of `f`, by name IDs.
+
+    English names for Windows are preferred, then any names for Windows, and
+    then names for other platforms.
+    """
+    # Skip the version, and the search hints after the number of tables.
+    f.seek(offset + 4)
+    (num_tables,) = struct.unpack(">H6x", f.read(8))
+    table_offset = None
+    for _ in range(num_tables):
+        tag, _, table_offset_, _ = struct.unpack(">4sIII", f.read(16))
+        if tag == b"name":
+            table_offset = table_offset_
+            break
+    if table_offset is None:
+        raise ValueError("no name table")
+
+    f.seek(table_offset)
+    _, count, string_offset = struct.unpack(">HHH", f.read(6))
+    records = [struct.unpack(">6H", f.read(12)) for _ in range(count)]
+    names: Dict[int, Tuple[int, str]] = {}
+    for platform, encoding, language, name_id, length, str_offset in records:
+        if name_id not in (
+            NAME_FAMILY,
+            NAME_STYLE,
+            NAME_VERSION,
+            NAME_TYPOGRAPHIC_FAMILY,
+            NAME_TYPOGRAPHIC_STYLE,
+        ):
+            continue
+        if platform == 3 and language == 0x409:
+            rank = 0
+        elif platform == 3:
+            rank = 1
+        elif platform in (0, 1):
+            rank = 2
+        else:
+            continue
+        if name_id in names and names[name_id][0] <= rank:
+            continue
+        f.seek(table_offset + string_offset + str_offset)
+        data = f.read(length)
+        codec = "mac_roman" if platform == 1 else "utf-16-be"
+        names[name_id] = (rank, data.decode(codec, errors="replace").strip())
+    return {name_id: name for name_id, (_, name) in names.items()}
+
+
+class FontIndex(Store):
+    """Metadata of fonts, kept in file `name` of the cache.
+
+    Each font is identified by an ID (like its path), and the signature of its
+    content, which must match for the metadata to be used. Fonts are indexed
+    without saving the index, which `save` does at once.
+    """
+
+    def __init__(self, name: str = "fonts.json") -> None:
+        super().__init__(name)
+
+    def lookup(
+        self, id: str, sig: list, open_font: Callable[[], IO[bytes]]
+    ) -> Optional[FontMeta]:
+        """Return the metadata of font `id` with signature `sig`.
+
+        If it is not indexed, read it from the file returned by `open_font` and
+        index it. Return `None` if the font cannot be read.
+        """
+        record = self.get(id)
+        if record is not None and record["sig"] == sig:
+            if record["faces"] is None:
+                return None
+            faces = [(family, style) for family, style in record["faces"]]
+            return FontMeta(faces, record["version"])
+        try:
+            with open_font() as f:
+                meta: Optional[FontMeta] = read_meta(f)
+        except (OSError, ValueError, struct.error) as e:
+            logging.debug("Cannot read font %s: %s", emph_path(id), e)
+            meta = None
+        self.put(id, sig, meta)
+        return meta
+
+    def put(self, id: str, sig: list, meta: Optional[FontMeta]) -> None:
+        """Index `meta` of font `id` with signature `sig`.
+
+        `meta` is `None` if the font cannot be read.
+        """
+        record = {
+            "sig": sig,
+            "faces": [list(face) for face in meta.faces] if meta else None,
+            "version": meta.version if meta else "",
+        }
+        self.set(id, record, save=False)
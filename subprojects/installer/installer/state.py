@@ -0,0 +1,103 @@
+"""Installation state remembered between runs.
+
+For every destination file installed, the state records its source and how
+both looked (modification time, size and inode) right after installation. If
+they still look the same, the destination is up to date, which is proven with
+one `stat` of each instead of inspecting the destination in depth.
+"""
+
+import json
+import logging
+import os
+from pathlib import Path
+from threading import Lock
+from typing import Dict, List, Optional
+
+from installer.cache import cache_dir
+from installer.style import emph_path
+
+
+def stat_key(st: os.stat_result) -> List[int]:
+    """Return the parts of `st` that change whenever a file is modified."""
+    return [st.st_mtime_ns, st.st_size, st.st_ino]
+
+
+class State:
+    """Recorded destinations, loaded from and saved to `path`."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.lock = Lock()
+        self.dirty = False
+        self.records: Dict[str, dict] = {}
+        try:
+            with open(path, "r") as f:
+                self.records = json.load(f)
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logging.debug("Ignoring broken state %s: %s", emph_path(path), e)
+
+    def is_current(self, src: Path, dst: Path, kind: str) -> bool:
+        """Return `True` if `dst` is recorded as the up-to-date `kind` of `src`.
+
+        `kind` is how `dst` was made from `src`, like "link" or "copy".
+        """
+        with self.lock:
+            record = self.records.get(str(dst))
+        if record is None or record["src"] != str(src) or record["kind"] != kind:
+            return False
+        try:
+            src_st = os.stat(src)
+            dst_st = os.lstat(dst)
+        except OSError:
+            return False
+        return stat_key(src_st) == record["src_stat"] and stat_key(
+            dst_st
+        ) == record["dst_stat"]
+
+    def record(self, src: Path, dst: Path, kind: str) -> None:
+        """Record that `dst` has just been made from `src` as `kind`."""
+        try:
+            record = {
+                "src": str(src),
+                "kind": kind,
+                "src_stat": stat_key(os.stat(src)),
+                "dst_stat": stat_key(os.lstat(dst)),
+            }
+        except OSError:
+            return
+        with self.lock:
+            self.records[str(dst)] = record
+            self.dirty = True
+
+    def save(self) -> None:
+        """Save the records if anything has changed."""
+        with self.lock:
+            if not self.dirty:
+                return
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(self.records, f)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+
+
+# The state of the current run, loaded when first needed.
+_state: Optional[State] = None
+_state_lock = Lock()
+
+
+def get_state() -> State:
+    """Return the state of the current run."""
+    global _state
+    with _state_lock:
+        if _state is None:
+            _state = State(cache_dir().joinpath("state.json"))
+        return _state
+
+
+def save_state() -> None:
+    """Save the state of the current run, if it has been loaded."""
+    if _state is not None:
+        _state.save()
@@ -1,8 +1,9 @@
-"""Utility for styled printing."""
+"""Utility for styled text."""
 
 import logging
+import re
 from os import PathLike
-from typing import Union
+from typing import Optional, Union
 
 
 def emph(s: str) -> str:
@@ -17,13 +18,21 @@ def emph_cmd(cmd: str) -> str:
     """Emphasize `cmd` by making it magenta."""
     return "\u001b[35m" + cmd + "\u001b[0m"
 
-def print_done():
-    """Print a \"done\"."""
-    print("done")
+def plain(s: str) -> str:
+    """Return `s` without any styling."""
+    return re.sub("\u001b\\[[0-9;]*m", "", s)
 
-def print_failed():
-    """Print a \"failed\"."""
-    print("\u001b[31m" + "failed" + "\u001b[0m")
+def done_text(note: Optional[str] = None) -> str:
+    """Return a \"done\", followed by `note` if any."""
+    return "done" if not note else f"done ({note})"
+
+def failed_text() -> str:
+    """Return a red \"failed\"."""
+    return "\u001b[31m" + "failed" + "\u001b[0m"
+
+def skipped_text() -> str:
+    """Return a yellow \"skipped\"."""
+    return "\u001b[33m" + "skipped" + "\u001b[0m"
 
 class Formatter(logging.Formatter):
 
@@ -43,13 +52,6 @@ class Formatter(logging.Formatter):
 
     def format(self, record: logging.LogRecord) -> str:
         prefix = "[" + self.INDICATORS[record.levelno] + "] "
-        content = str(record.msg)
-        return prefix + content
-
-def setup_logging(debug: bool = False):
-    """Set up logging."""
-    sh = logging.StreamHandler()
-    sh.setFormatter(Formatter())
-    logging.getLogger().addHandler(sh)
-    if debug:
-        logging.getLogger().setLevel(logging.DEBUG)
+        # Arguments are only merged into the message here, so records never
+        # shown are never formatted.
+        return prefix + record.getMessage()
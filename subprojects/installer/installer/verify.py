@@ -0,0 +1,146 @@
+"""Verification of an installed machine against the install plan.
+
+Verification never changes anything. Every destination of the plan is checked
+concurrently: links must point to their sources, and copies must have the
+content of their sources (compared by hash, not by modification time). Fonts
+are checked for presence if asked to.
+"""
+
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from installer.console import get_console
+from installer.file import file_digest, is_link_to, tree_pairs
+from installer.opt import Options
+from installer.plan import Entry
+from installer.style import emph_path
+
+# Exit codes of verification.
+EXIT_OK = 0
+EXIT_DRIFT = 1
+EXIT_ERROR = 2
+
+# A drifted destination, and how it has drifted.
+Drift = Tuple[str, str]
+
+
+def same_digest(path1: str, path2: str) -> bool:
+    """Return `True` if files `path1` and `path2` have the same content."""
+    if os.path.getsize(path1) != os.path.getsize(path2):
+        return False
+    return file_digest(Path(path1)) == file_digest(Path(path2))
+
+
+def check_file(src: Path, dst: Path, kind: str) -> Optional[str]:
+    """Check destination file `dst` of `src`, returning how it drifted if so.
+
+    A link may also be a copy, which is what the installer falls back to if
+    linking is not permitted.
+    """
+    if not os.path.lexists(dst):
+        return "missing"
+    if os.path.islink(dst):
+        if kind == "link" and os.path.realpath(dst) == os.path.realpath(src):
+            return None
+        return "wrong link"
+    if not os.path.isfile(dst):
+        return "not a file"
+    if not same_digest(str(src), str(dst)):
+        return "differs"
+    return None
+
+
+def check_entry(entry: Entry) -> List[Drift]:
+    """Check the destinations of link or copy `entry`, returning drifts."""
+    src_path, dst_path = Path(entry.src_path), Path(entry.dst_path)
+    if not src_path.exists():
+        return [(entry.src_path, "source missing")]
+    if entry.kind == "link" and src_path.is_dir() and is_link_to(dst_path, src_path):
+        return []
+    drifts = []
+    for src, dst, is_dir in tree_pairs(src_path, dst_path):
+        if is_dir:
+            if not os.path.isdir(dst):
+                drifts.append((str(dst), "missing directory"))
+            continue
+        problem = check_file(src, dst, entry.kind)
+        if problem is not None:
+            drifts.append((str(dst), problem))
+    return drifts
+
+
+def check_fonts(opt: Options) -> List[Drift]:
+    """Check that every font in "ZyFonts.zip" is present, returning drifts.
+
+    Fonts are selected as installation does, so that duplicated fonts, and fonts
+    installed from elsewhere in the same or a newer version, are not drifts.
+    """
+    from installer.font import (
+        ZipHandles,
+        find_zyfonts,
+        font_dir,
+        select_fonts_in,
+        select_fonts_in_zip,
+    )
+    from installer.sfnt import FontIndex
+
+    src = find_zyfonts()
+    fontdir = font_dir()
+    index = FontIndex()
+    try:
+        if src.is_dir():
+            fonts = [
+                (font.name, os.path.getsize(font))
+                for font in select_fonts_in(src, fontdir, opt, index)
+            ]
+        else:
+            handles = ZipHandles(src)
+            try:
+                fonts = [
+                    (os.path.basename(info.filename), info.file_size)
+                    for info in select_fonts_in_zip(handles, fontdir, opt, index)
+                ]
+            finally:
+                handles.close()
+    finally:
+        index.save()
+    drifts = []
+    for name, size in fonts:
+        path = fontdir.joinpath(name)
+        try:
+            if os.path.getsize(path) != size:
+                drifts.append((str(path), "differs"))
+        except OSError:
+            drifts.append((str(path), "missing"))
+    return drifts
+
+
+def verify(entries: List[Entry], opt: Options) -> int:
+    """Verify destinations of `entries` (and fonts if `opt.fonts`).
+
+    Show every drift as a warning, and return the exit code. Checks are run
+    concurrently, with at least as many workers as CPUs, since they only read.
+    """
+    entries = [entry for entry in entries if entry.kind in ("link", "copy")]
+    workers = max(opt.jobs, os.cpu_count() or 1)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(check_entry, entry) for entry in entries]
+        if opt.fonts:
+            futures.append(pool.submit(check_fonts, opt))
+        try:
+            drifts = [drift for future in futures for drift in future.result()]
+        except Exception as e:
+            logging.error("Cannot verify: %s", e)
+            return EXIT_ERROR
+
+    console = get_console()
+    for path, problem in drifts:
+        logging.warning("%s: %s", problem, emph_path(path))
+    if drifts:
+        console.message(f"Found {len(drifts)} drifted destinations.")
+        return EXIT_DRIFT
+    console.message(f"Verified {len(entries)} entries, no drift found.")
+    return EXIT_OK
@@ -0,0 +1,35 @@
+"""Utility for walking directory trees.
+
+The walker is built on `os.scandir`, whose entries carry the file type read
+along with the directory, so telling files from directories needs no extra
+system calls on most platforms. It keeps its own stack instead of recursing,
+so deep trees never hit the recursion limit.
+"""
+
+import os
+from pathlib import Path
+from typing import Iterator, List, Tuple
+
+
+def walk(
+    root: Path, follow_symlinks: bool = True
+) -> Iterator[Tuple[str, os.DirEntry]]:
+    """Yield every entry under directory `root` with its path relative to it.
+
+    A directory is yielded before its content. Symbolic links to directories
+    are followed, like `Path.is_file` does, unless `follow_symlinks` is
+    `False`.
+    """
+    stack: List[Tuple[str, str]] = [("", str(root))]
+    while stack:
+        rel_dir, dir = stack.pop()
+        with os.scandir(dir) as it:
+            entries = sorted(it, key=lambda entry: entry.name)
+        # Push subdirectories in reverse, so that they are popped in order.
+        subdirs = []
+        for entry in entries:
+            rel = os.path.join(rel_dir, entry.name)
+            yield rel, entry
+            if entry.is_dir(follow_symlinks=follow_symlinks):
+                subdirs.append((rel, entry.path))
+        stack.extend(reversed(subdirs))
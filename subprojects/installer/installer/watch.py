@@ -0,0 +1,214 @@
+"""Watching sources and re-applying the install plan as they change.
+
+On Linux, changes are received from inotify (through `ctypes`, so nothing has
+to be installed); elsewhere, or if inotify is unavailable, the sources are
+polled. Only the link and copy entries whose sources have changed are run
+again.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import select
+import struct
+import time
+from pathlib import Path
+from typing import Dict, List, Set, Tuple, Union
+
+from installer.console import get_console
+from installer.journal import get_journal
+from installer.opt import Options
+from installer.os import IS_LINUX
+from installer.plan import Entry, entry_job
+from installer.sched import Scheduler
+from installer.state import save_state
+from installer.style import emph_path
+from installer.walk import walk
+
+# Seconds to wait for more changes after one, so that a burst of changes (like
+# a checkout) is handled at once.
+SETTLE_TIME = 0.2
+
+# Inotify event flags, from <sys/inotify.h>.
+IN_ATTRIB = 0x4
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_FROM = 0x40
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_DELETE_SELF = 0x400
+IN_Q_OVERFLOW = 0x4000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+IN_MASK = (
+    IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+)
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class PollingWatcher:
+    """Watcher comparing snapshots of files under `roots` every `interval`."""
+
+    def __init__(self, roots: List[Path], interval: float = 1.0) -> None:
+        self.roots = roots
+        self.interval = interval
+        self.snapshot = self.take_snapshot()
+
+    def take_snapshot(self) -> Dict[str, Tuple[int, int]]:
+        snapshot = {}
+        for root in self.roots:
+            if not root.exists():
+                continue
+            paths = [str(root)] if not root.is_dir() else []
+            paths += [entry.path for _, entry in walk(root) if not entry.is_dir()]
+            for path in paths:
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                snapshot[path] = (st.st_mtime_ns, st.st_size)
+        return snapshot
+
+    def wait(self) -> Set[str]:
+        """Wait until some files change, returning their paths."""
+        while True:
+            time.sleep(self.interval)
+            snapshot = self.take_snapshot()
+            changed = {
+                path
+                for path in snapshot.keys() | self.snapshot.keys()
+                if snapshot.get(path) != self.snapshot.get(path)
+            }
+            self.snapshot = snapshot
+            if changed:
+                return changed
+
+
+class InotifyWatcher:
+    """Watcher receiving changes of files under `roots` from inotify.
+
+    Directories are watched instead of files, since editors often replace a
+    file instead of writing to it.
+    """
+
+    def __init__(self, roots: List[Path]) -> None:
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.roots = roots
+        self.dirs: Dict[int, str] = {}
+        for root in roots:
+            if root.is_dir():
+                self.add_tree(str(root))
+            else:
+                self.add_dir(str(root.parent))
+
+    def add_dir(self, dir: str) -> None:
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(dir), IN_MASK)
+        if wd < 0:
+            logging.warning("Cannot watch %s", emph_path(dir))
+        else:
+            self.dirs[wd] = dir
+
+    def add_tree(self, dir: str) -> None:
+        self.add_dir(dir)
+        for _, entry in walk(Path(dir)):
+            if entry.is_dir():
+                self.add_dir(entry.path)
+
+    def read_events(self, timeout: Union[float, None]) -> Set[str]:
+        """Read events for at most `timeout` seconds, returning changed paths."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return set()
+        data = os.read(self.fd, 64 * 1024)
+        changed = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                # Events are lost, so consider everything changed.
+                return {str(root) for root in self.roots}
+            dir = self.dirs.get(wd)
+            if dir is None:
+                continue
+            path = os.path.join(dir, os.fsdecode(name)) if name else dir
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                self.add_tree(path)
+            changed.add(path)
+        return changed
+
+    def wait(self) -> Set[str]:
+        """Wait until some files change, returning their paths."""
+        changed = self.read_events(None)
+        while True:
+            more = self.read_events(SETTLE_TIME)
+            if not more:
+                return changed
+            changed |= more
+
+
+def make_watcher(roots: List[Path]) -> Union[InotifyWatcher, PollingWatcher]:
+    """Return a watcher of `roots`, using inotify if possible."""
+    if IS_LINUX:
+        try:
+            return InotifyWatcher(roots)
+        except (OSError, AttributeError) as e:
+            logging.debug("Falling back to polling: %s", e)
+    return PollingWatcher(roots)
+
+
+def is_under(path: str, root: str) -> bool:
+    """Return `True` if `path` is `root` or inside it."""
+    return path == root or path.startswith(root.rstrip(os.sep) + os.sep)
+
+
+def prune(entry: Entry, path: str) -> None:
+    """Remove the link to `path` made for `entry`, if `path` is removed."""
+    if os.path.lexists(path) or entry.kind != "link":
+        return
+    dst = os.path.join(entry.dst_path, os.path.relpath(path, entry.src_path))
+    if os.path.islink(dst) and os.readlink(dst) == path:
+        os.unlink(dst)
+        logging.debug("Removed %s, whose source is removed", emph_path(dst))
+
+
+def watch(entries: List[Entry], opt: Options) -> None:
+    """Run link and copy `entries` again whenever their sources change.
+
+    Watch until interrupted.
+    """
+    entries = [
+        entry
+        for entry in entries
+        if entry.kind in ("link", "copy")
+        and (not entry.cond or getattr(opt, entry.cond))
+    ]
+    watcher = make_watcher([Path(entry.src_path) for entry in entries])
+    get_console().message("Watching for changes. Press Ctrl-C to stop.")
+    while True:
+        changed = watcher.wait()
+        sched = Scheduler(opt.jobs)
+        for entry in entries:
+            paths = [path for path in changed if is_under(path, entry.src_path)]
+            if not paths:
+                continue
+            if not opt.dry:
+                for path in paths:
+                    prune(entry, path)
+            sched.add(entry_job(entry, opt))
+        sched.run()
+        save_state()
+        if not opt.dry:
+            get_journal().commit()
@@ -0,0 +1,36 @@
+"""Tests of installing AutoHotkey scripts."""
+
+from pathlib import Path
+
+from installer.ahk import ahk_install_all
+from installer.opt import Options
+
+
+def test_second_run_skips_compiling(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path.joinpath("cache")))
+    # "%appdata%" is not expanded off Windows, so the program is installed here.
+    monkeypatch.chdir(tmp_path)
+    startup = tmp_path.joinpath(
+        "%appdata%/Microsoft/Windows/Start Menu/Programs/Startup"
+    )
+    startup.mkdir(parents=True)
+    dir = tmp_path.joinpath("ahk")
+    dir.mkdir()
+    dir.joinpath("keys.ahk").write_text("CapsLock::Esc")
+    compiled = []
+
+    def runner(cmd, opt, cwd=None):
+        compiled.append(cmd)
+        Path(cwd).joinpath("keys.exe").write_text("keys")
+        return 0
+
+    for _ in range(2):
+        (job,) = ahk_install_all(str(dir), Options(), runner, Path("Ahk2Exe.exe"))
+        assert job.run()
+    assert len(compiled) == 1
+    assert startup.joinpath("keys.exe").read_text() == "keys"
+
+    dir.joinpath("keys.ahk").write_text("CapsLock::Ctrl")
+    (job,) = ahk_install_all(str(dir), Options(), runner, Path("Ahk2Exe.exe"))
+    assert job.run()
+    assert len(compiled) == 2
@@ -0,0 +1,40 @@
+"""Tests of installing fonts."""
+
+import zipfile
+
+import pytest
+
+from installer.font import install_fonts_in, install_fonts_in_zip
+from installer.opt import Options
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    # Keep the journal of installed fonts out of the real cache.
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path.joinpath("cache")))
+
+
+def test_same_names_in_zip(tmp_path):
+    zip = tmp_path.joinpath("fonts.zip")
+    with zipfile.ZipFile(zip, "w") as zf:
+        for i in range(8):
+            zf.writestr(f"dir{i}/Same.ttf", f"font {i}")
+    for run in range(20):
+        fontdir = tmp_path.joinpath(f"fonts{run}")
+        fontdir.mkdir()
+        assert install_fonts_in_zip(zip, fontdir, Options(jobs=8)) == 1
+        assert fontdir.joinpath("Same.ttf").read_text() == "font 7"
+        assert [path.name for path in fontdir.iterdir()] == ["Same.ttf"]
+
+
+def test_same_names_in_dir(tmp_path):
+    src = tmp_path.joinpath("src")
+    for i in range(8):
+        src.joinpath(f"dir{i}").mkdir(parents=True)
+        src.joinpath(f"dir{i}", "Same.ttf").write_text(f"font {i}")
+    for run in range(20):
+        fontdir = tmp_path.joinpath(f"fonts{run}")
+        fontdir.mkdir()
+        assert install_fonts_in(src, fontdir, Options(jobs=8)) == 1
+        assert fontdir.joinpath("Same.ttf").read_text() == "font 7"
+        assert [path.name for path in fontdir.iterdir()] == ["Same.ttf"]
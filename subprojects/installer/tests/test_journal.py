@@ -0,0 +1,72 @@
+"""Tests of the journal of replaced destinations."""
+
+import os
+
+from installer.file import link_dir
+from installer.job import Job, set_current_job
+from installer.journal import Journal, tmp_path
+
+
+def write(journal: Journal, job: Job, path, content: str) -> None:
+    """Write `content` to `path` through `journal` as `job`."""
+    set_current_job(job)
+    try:
+        tmp = tmp_path(path)
+        tmp.write_text(content)
+        journal.replace(tmp, path)
+    finally:
+        set_current_job(None)
+
+
+def test_rollback_jobs_of_same_message(tmp_path):
+    tmp_path.joinpath("journal").mkdir()
+    journal = Journal(tmp_path.joinpath("journal"))
+    first = Job("Writing", lambda: None)
+    second = Job("Writing", lambda: None)
+    write(journal, first, tmp_path.joinpath("a"), "a")
+    write(journal, second, tmp_path.joinpath("b"), "b")
+    assert journal.rollback(second.id) == 1
+    assert tmp_path.joinpath("a").read_text() == "a"
+    assert not tmp_path.joinpath("b").exists()
+
+
+def test_rollback_dir_link(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path.joinpath("cache")))
+    src = tmp_path.joinpath("src")
+    src.mkdir()
+    src.joinpath("file").write_text("file")
+    dst = tmp_path.joinpath("dst")
+    dst.mkdir()
+    os.symlink(src.joinpath("file"), dst.joinpath("file"))
+
+    from installer.journal import get_journal
+
+    job = Job("Linking", lambda: None)
+    set_current_job(job)
+    try:
+        assert link_dir(src, dst)
+    finally:
+        set_current_job(None)
+    assert dst.is_symlink()
+    get_journal().rollback(job.id)
+    assert not dst.is_symlink()
+    assert os.readlink(dst.joinpath("file")) == str(src.joinpath("file"))
+
+
+def test_foreign_dir_at_file_destination(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path.joinpath("cache")))
+    src = tmp_path.joinpath("bashrc")
+    src.write_text("bashrc")
+    dst = tmp_path.joinpath("home", ".bashrc")
+    dst.mkdir(parents=True)
+    dst.joinpath("data").write_text("precious")
+
+    from installer.file import link
+    from installer.journal import get_journal
+    from installer.opt import Options
+
+    job = link(str(src), str(dst), Options())
+    assert not job.run()
+    get_journal().commit()
+    assert dst.joinpath("data").read_text() == "precious"
+    assert not os.path.lexists(str(dst) + ".installer-tmp")
@@ -0,0 +1,24 @@
+"""Tests of install plans."""
+
+import json
+
+from installer.journal import get_journal
+from installer.opt import Options
+from installer.plan import compile_plan, entry_job, system_key
+
+
+def test_entry_without_dir_link(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path.joinpath("cache")))
+    src = tmp_path.joinpath("rime")
+    src.mkdir()
+    src.joinpath("default.yaml").write_text("schema_list: []")
+    dst = tmp_path.joinpath("appdata", "rime")
+    item = {"link": str(src), "to": str(dst), "dir_link": False}
+    manifest = json.dumps({system_key(): [item]}).encode("utf-8")
+    (entry,) = compile_plan(manifest)
+
+    assert entry_job(entry, Options(dir_links=True)).run()
+    get_journal().commit()
+    # Files written by programs must not land in the source.
+    assert not dst.is_symlink()
+    assert dst.joinpath("default.yaml").is_symlink()
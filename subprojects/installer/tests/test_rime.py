@@ -0,0 +1,89 @@
+"""Tests of keying Rime schemas for rebuilding."""
+
+import pytest
+
+from installer.cache import Store
+from installer.rime import schema_keys
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path.joinpath("cache")))
+    return Store("rime.json")
+
+
+def write(dir, name: str, content: str) -> None:
+    dir.joinpath(name).write_text(content, encoding="utf-8")
+
+
+def make_src(tmp_path, schema: str, dict_header: str):
+    src = tmp_path.joinpath("rime")
+    src.mkdir()
+    write(src, "a.schema.yaml", schema)
+    write(src, "a.dict.yaml", f"---\nname: a\n{dict_header}...\n\nword\tcode\n")
+    write(src, "b.dict.yaml", "word\tcode\n")
+    return src
+
+
+def key_after_changing_b(src, store):
+    """Return the key of schema "a" before and after changing dictionary "b"."""
+    before = schema_keys(src, store)[src.joinpath("a.schema.yaml")]
+    write(src, "b.dict.yaml", "other\tcode\n")
+    after = schema_keys(src, store)[src.joinpath("a.schema.yaml")]
+    return before, after
+
+
+def test_block_import_tables(tmp_path, store):
+    schema = (
+        "schema:\n  schema_id: a\n"
+        "translator:\n  dictionary: &d\n    a\n"
+        "reverse_lookup:\n  dictionary: *d\n"
+    )
+    src = make_src(tmp_path, schema, "import_tables:\n  - b\n")
+    before, after = key_after_changing_b(src, store)
+    assert before is not None and before != after
+
+
+def test_flow_import_tables(tmp_path, store):
+    schema = 'schema:\n  schema_id: a\n"translator":\n  "dictionary": a\n'
+    src = make_src(tmp_path, schema, "import_tables: [b]\n")
+    before, after = key_after_changing_b(src, store)
+    assert before is not None and before != after
+
+
+def test_custom_dictionary(tmp_path, store):
+    schema = "schema:\n  schema_id: a\ntranslator:\n  dictionary: c\n"
+    src = make_src(tmp_path, schema, "")
+    write(src, "a.custom.yaml", "patch:\n  translator/dictionary: b\n")
+    before, after = key_after_changing_b(src, store)
+    assert before is not None and before != after
+
+
+@pytest.mark.parametrize(
+    "schema",
+    [
+        "__include: other:/\nschema:\n  schema_id: a\n",
+        "schema:\n  schema_id: a\ntranslator:\n  dictionary: *unknown\n",
+        "schema:\n  schema_id: a\ntranslator: {dictionary: a}\n",
+        "schema:\n  schema_id: a\n  bare words\n",
+    ],
+)
+def test_unparsable_schema(tmp_path, store, schema):
+    src = make_src(tmp_path, schema, "")
+    assert schema_keys(src, store)[src.joinpath("a.schema.yaml")] is None
+
+
+@pytest.mark.parametrize(
+    "schema",
+    [
+        "schema:\n  schema_id: a\n  dependencies:\n    - b\n",
+        "schema:\n  schema_id: a\nreverse_lookup:\n  prism: b\n",
+    ],
+)
+def test_dependency_schema(tmp_path, store, schema):
+    src = make_src(tmp_path, schema, "")
+    write(src, "b.schema.yaml", "schema:\n  schema_id: b\n")
+    a = src.joinpath("a.schema.yaml")
+    before = schema_keys(src, store)[a]
+    write(src, "b.custom.yaml", "patch:\n  speller/algebra: []\n")
+    assert before is not None and schema_keys(src, store)[a] != before
@@ -0,0 +1,47 @@
+"""Tests of verifying an installed machine."""
+
+import struct
+
+import pytest
+
+import installer.font
+from installer.opt import Options
+from installer.verify import check_fonts
+
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    # Keep the font index out of the real cache.
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path.joinpath("cache")))
+
+
+def make_font(family: str, version: str) -> bytes:
+    """Return a font with only a "name" table, naming `family` and `version`."""
+    strings = [(1, family), (2, "Regular"), (5, version)]
+    data = b""
+    records = b""
+    for name_id, string in strings:
+        encoded = string.encode("utf-16-be")
+        records += struct.pack(">6H", 3, 1, 0x409, name_id, len(encoded), len(data))
+        data += encoded
+    table = struct.pack(">HHH", 0, len(strings), 6 + len(records)) + records + data
+    header = struct.pack(">IH6x", 0x00010000, 1)
+    entry = struct.pack(">4sIII", b"name", 0, 12 + 16, len(table))
+    return header + entry + table
+
+
+def test_check_fonts_follows_selection(tmp_path, monkeypatch):
+    src = tmp_path.joinpath("ZyFonts")
+    src.mkdir()
+    src.joinpath("Old.ttf").write_bytes(make_font("Sans", "Version 1.0"))
+    src.joinpath("New.ttf").write_bytes(make_font("Sans", "Version 2.0"))
+    src.joinpath("Serif.ttf").write_bytes(make_font("Serif", "Version 1.0"))
+    fontdir = tmp_path.joinpath("fonts")
+    fontdir.mkdir()
+    # Installed from elsewhere, in the same version as the newest in `src`.
+    fontdir.joinpath("Sans-Regular.ttf").write_bytes(make_font("Sans", "2.0"))
+    monkeypatch.setattr(installer.font, "find_zyfonts", lambda: src)
+    monkeypatch.setattr(installer.font, "font_dir", lambda: fontdir)
+
+    drifts = check_fonts(Options())
+    assert drifts == [(str(fontdir.joinpath("Serif.ttf")), "missing")]